@@ -0,0 +1,276 @@
+""" Reproducible benchmarks for image and video hot paths
+
+Usage (from repository root):
+    python -m benchmarks.run_benchmarks --save              # record baselines/<host>.json
+    python -m benchmarks.run_benchmarks                     # compare with baseline, exit code 1 on regression
+    python -m benchmarks.run_benchmarks --filter sketch     # only cases containing "sketch"
+
+Every case is timed over several repeats (median wall time), run once more under tracemalloc
+for peak Python memory and once more for peak resident memory. Inputs are the sample assets in
+testing/ (images and video) resized to fixed resolutions,
+ImageEffects cases vary animation length instead (--frames) because the class resizes inputs itself.
+Cases whose dependencies or models are missing are reported as skipped.
+"""
+import os
+import sys
+import cv2
+import json
+import time
+import typing
+import platform
+import argparse
+import tempfile
+import threading
+import statistics
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESOLUTIONS = {"480p": (640, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+ANIMEGAN_MODELS = ['Hayao_64', 'Hayao-60', 'Paprika_54', 'Shinkai_53']
+EFFECTS = ["smooth_transition", "picture_in_picture", "ken_burns_effect", "parallax_effect",
+           "glitch_effect", "rotation_3d", "particles_transition"]
+
+class Skip(Exception):
+    pass
+
+def load_image(name: str, size: typing.Tuple[int, int]) -> np.ndarray:
+    image = cv2.imread(os.path.join(ROOT, "testing", name))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+def sketch_cases() -> typing.Iterator[typing.Tuple[str, typing.Callable]]:
+    from utils.BatchSketchApp import ImageToSketchProcessor
+    for resolution, size in RESOLUTIONS.items():
+        image = load_image("color_image1.jpg", size)
+        yield f"sketch.convert_to_sketch.{resolution}", lambda image=image: ImageToSketchProcessor.convert_to_sketch(image)
+
+def animegan_cases() -> typing.Iterator[typing.Tuple[str, typing.Callable]]:
+    for model in ANIMEGAN_MODELS:
+        model_path = os.path.join(ROOT, "models", f"{model}.onnx")
+        for resolution, size in RESOLUTIONS.items():
+            name = f"animegan.{model}.{resolution}"
+            if not os.path.exists(model_path):
+                yield name, None
+                continue
+            image = load_image("color_image1.jpg", size)
+            def case(image=image, model_path=model_path):
+                from utils.animegan import get_registry
+                # Registry keeps the session warm, so the case measures inference and not model loading
+                return get_registry().get(model_path)(image)
+            yield name, case
+
+def segmentation_cases() -> typing.Iterator[typing.Tuple[str, typing.Callable]]:
+    segmentation = None
+    for resolution, size in RESOLUTIONS.items():
+        image = load_image("color_image1.jpg", size)
+        def case(image=image):
+            nonlocal segmentation
+            if segmentation is None:
+                try:
+                    from utils.selfieSegmentation import MPSegmentation
+                    segmentation = MPSegmentation()
+                except Exception as e:
+                    raise Skip(f"mediapipe selfie segmentation unavailable: {e}")
+            return segmentation(image)
+        yield f"segmentation.MPSegmentation.{resolution}", case
+
+def effects_cases(frame_counts: typing.Sequence[int]) -> typing.Iterator[typing.Tuple[str, typing.Callable]]:
+    from utils.image_effects import ImageEffects
+    # ImageEffects resizes inputs to 500x500, so work scales with animation length and not input resolution
+    sketch = Image.fromarray(cv2.cvtColor(cv2.imread(os.path.join(ROOT, "testing", "sketch_image1.jpg")), cv2.COLOR_BGR2RGB))
+    color = Image.fromarray(cv2.cvtColor(cv2.imread(os.path.join(ROOT, "testing", "color_image1.jpg")), cv2.COLOR_BGR2RGB))
+    for num_frames in frame_counts:
+        for effect in EFFECTS:
+            def case(effect=effect, num_frames=num_frames):
+                return getattr(ImageEffects(sketch, color), effect)(num_frames=num_frames)
+            yield f"effects.{effect}.{num_frames}frames", case
+
+def animator_cases() -> typing.Iterator[typing.Tuple[str, typing.Callable]]:
+    from utils.ImageTransitionAnimator import ImageTransitionAnimator
+    for resolution, size in RESOLUTIONS.items():
+        sketch = Image.fromarray(cv2.cvtColor(load_image("sketch_image1.jpg", size), cv2.COLOR_BGR2RGB))
+        color = Image.fromarray(cv2.cvtColor(load_image("color_image1.jpg", size), cv2.COLOR_BGR2RGB))
+        def case(sketch=sketch, color=color):
+            animator = ImageTransitionAnimator(sketch_image=sketch, color_image=color, duration=1)
+            return animator.create_video_in_memory(animator.iter_transition_frames())
+        yield f"animator.transition_video.{resolution}", case
+
+def resize_video(video_path: str, output_path: str, size: typing.Tuple[int, int]) -> None:
+    cap = cv2.VideoCapture(video_path)
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), cap.get(cv2.CAP_PROP_FPS), size)
+    while True:
+        success, frame = cap.read()
+        if not success:
+            break
+        out.write(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+    cap.release()
+    out.release()
+
+def engine_cases(work_dir: str) -> typing.Iterator[typing.Tuple[str, typing.Callable]]:
+    from utils.engine import Engine
+    from utils.BatchSketchApp import SketchKernel
+    def to_bgr(kernel):
+        return lambda frame: cv2.cvtColor(kernel(frame), cv2.COLOR_GRAY2BGR)
+    for resolution, size in RESOLUTIONS.items():
+        video_path = os.path.join(work_dir, f"video1_{resolution}.mp4")
+        resize_video(os.path.join(ROOT, "testing", "video1.mp4"), video_path, size)
+        yield f"engine.process_video.sketch.{resolution}", lambda video_path=video_path: Engine(
+            video_path=video_path, custom_objects=[to_bgr(SketchKernel())]).process_video()
+        yield f"engine.process_video.sketch_pipelined.{resolution}", lambda video_path=video_path: Engine(
+            video_path=video_path, custom_objects=[to_bgr(SketchKernel())], pipelined=True).process_video()
+
+
+def _rss_mb() -> typing.Optional[float]:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss(case: typing.Callable, interval: float = 0.005) -> typing.Optional[float]:
+    """Peak resident memory in MB while case runs, covers native buffers of OpenCV and onnxruntime
+    that tracemalloc doesn't see. ru_maxrss only grows over the process lifetime, so on Linux the
+    peak is reset through /proc/self/clear_refs, elsewhere RSS is sampled every interval seconds
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        peak_reset = True
+    except OSError:
+        peak_reset = False
+    if peak_reset:
+        case()
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+        return None
+
+    if _rss_mb() is None:
+        case()
+        return None
+    peak = _rss_mb()
+    done = threading.Event()
+    def sample():
+        nonlocal peak
+        while not done.wait(interval):
+            peak = max(peak, _rss_mb())
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        case()
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak, _rss_mb())
+
+def measure(case: typing.Callable, repeats: int) -> dict:
+    case()  # warm up, loads models and fills caches
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        case()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    case()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "median_ms": statistics.median(timings) * 1000,
+        "min_ms": min(timings) * 1000,
+        "peak_python_mb": peak / 1024 / 1024,
+        # Separate run, tracemalloc overhead would inflate it
+        "peak_rss_mb": peak_rss(case),
+    }
+
+def compare(results: dict, baseline: dict, time_threshold: float, memory_threshold: float) -> typing.List[str]:
+    """Return description of every metric that regressed past threshold"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference or "median_ms" not in result or "median_ms" not in reference:
+            continue
+        if result["median_ms"] > reference["median_ms"] * (1 + time_threshold):
+            regressions.append(f"{name}: median {result['median_ms']:.1f}ms vs baseline {reference['median_ms']:.1f}ms")
+        if result["peak_python_mb"] > reference["peak_python_mb"] * (1 + memory_threshold) + 1:
+            regressions.append(f"{name}: peak {result['peak_python_mb']:.1f}MB vs baseline {reference['peak_python_mb']:.1f}MB")
+        if result.get("peak_rss_mb") is not None and reference.get("peak_rss_mb") is not None and \
+                result["peak_rss_mb"] > reference["peak_rss_mb"] * (1 + memory_threshold) + 1:
+            regressions.append(f"{name}: peak RSS {result['peak_rss_mb']:.1f}MB vs baseline {reference['peak_rss_mb']:.1f}MB")
+    return regressions
+
+def default_baseline_path() -> str:
+    # Timings are only comparable on the same kind of machine
+    host = f"{platform.node()}-{platform.machine()}".replace(os.sep, "_")
+    return os.path.join(ROOT, "benchmarks", "baselines", f"{host}.json")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark image and video hot paths")
+    parser.add_argument("--filter", default="", help="run only cases whose name contains this text")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--frames", type=int, nargs="+", default=[10, 30], help="ImageEffects animation lengths to run")
+    parser.add_argument("--baseline", default=default_baseline_path())
+    parser.add_argument("--save", action="store_true", help="store results as new baseline")
+    parser.add_argument("--time-threshold", type=float, default=0.15, help="allowed relative slowdown")
+    parser.add_argument("--memory-threshold", type=float, default=0.20, help="allowed relative memory growth")
+    parser.add_argument("--output", help="also write results to this json file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        groups = [sketch_cases, animegan_cases, segmentation_cases, lambda: effects_cases(args.frames),
+                  animator_cases, lambda: engine_cases(work_dir)]
+        for group in groups:
+            for name, case in group():
+                if args.filter not in name:
+                    continue
+                try:
+                    if case is None:
+                        raise Skip("model file missing")
+                    results[name] = measure(case, args.repeats)
+                    peak_rss_mb = results[name]["peak_rss_mb"]
+                    print(f"{name:55s} {results[name]['median_ms']:10.1f} ms {results[name]['peak_python_mb']:8.1f} MB "
+                          f"{peak_rss_mb if peak_rss_mb is not None else float('nan'):8.1f} MB RSS")
+                except Skip as e:
+                    results[name] = {"skipped": str(e)}
+                    print(f"{name:55s} skipped: {e}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update({name: result for name, result in results.items() if "median_ms" in result})
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save first")
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.time_threshold, args.memory_threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,10 +8,12 @@ import asyncio
 import base64
 import os
 import uuid
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import onnxruntime as ort
 
 # Initialize components
-from utils.BatchSketchApp import ImageToSketchProcessor
+from utils.BatchSketchApp import SketchVariantEngine
 from utils.ImageTransitionAnimator import ImageTransitionAnimator
 from utils.image_captioning import ImageCaptioning
 from deep_translator import GoogleTranslator
@@ -22,7 +24,19 @@ from utils.TelegramSender import TelegramSender
 from utils.image_effects import ImageEffects
 from utils.html5_slideshow_component import display_image_slideshow
 from utils.engine import Engine
-from utils.animegan import AnimeGAN
+from utils.animegan import AnimeGANBatcher, get_registry
+from utils.result_cache import ResultCache
+
+ANIMEGAN_MODELS = ['Hayao_64', 'Hayao-60', 'Paprika_54', 'Shinkai_53']
+
+# Sketch strength options shown to the user, all of them are computed from one shared blur stack
+SKETCH_VARIANTS = {
+    "רגיל": "sketch_21",
+    "חזק": "sketch_41",
+    "חזק מאוד": "sketch_61",
+    "מודגש": "edge_enhanced",
+    "עפרון צבעוני": "color_pencil",
+}
 
 # Initialize session state
 if 'state' not in st.session_state:
@@ -102,8 +116,56 @@ def load_video(video_url, placeholder):
     time.sleep(2)  # Small delay to ensure the placeholder is cleared
     placeholder.video(video_url, autoplay=True, loop=True)
 
-def process_image(image, model_name, use_cpu=False):
-    if use_cpu:
+@st.cache_resource
+def get_result_cache():
+    # Shared by all sessions of the process, the sqlite index makes it safe across server processes too
+    return ResultCache(max_size_mb=float(os.getenv("RESULT_CACHE_MAX_MB", 512)))
+
+def get_cache_key(file_bytes):
+    # Everything that changes pipeline outputs for the same upload must be part of the key
+    return ResultCache.make_key(
+        file_bytes,
+        version=2,
+        models=ANIMEGAN_MODELS,
+        cuda=is_cuda_available(),
+        tile_size=os.getenv("ANIMEGAN_TILE_SIZE", "0"),
+        precision=os.getenv("ANIMEGAN_PRECISION", "fp32"),
+        fused_io=os.getenv("ANIMEGAN_FUSED_IO", "0"),
+    )
+
+def animegan_thread_split(tile_size=0):
+    # All styles run concurrently, each gets an equal share of the cores. With tiling the share goes to
+    # tile workers and every onnxruntime run gets one thread, otherwise the session threads get it
+    cores_per_style = max(1, (os.cpu_count() or 1) // len(ANIMEGAN_MODELS))
+    if tile_size:
+        return cores_per_style, 1
+    return 1, cores_per_style
+
+@st.cache_resource
+def warm_animegan_models():
+    # Runs once per server process, the registry keeps sessions alive across sessions and reruns
+    _, ort_threads = animegan_thread_split(int(os.getenv("ANIMEGAN_TILE_SIZE", 0)))
+    # ORT_INTRA_OP_THREADS=0 (default) means split automatically, other session options still come from environment
+    session_options = {} if int(os.getenv("ORT_INTRA_OP_THREADS", 0)) else {"intra_op_num_threads": ort_threads}
+    registry = get_registry(session_options)
+    registry.warm([f"models/{model_name}.onnx" for model_name in ANIMEGAN_MODELS])
+    return registry
+
+@st.cache_resource
+def get_animegan_batcher(model_name):
+    # One batcher per model and server process, concurrent uploads share its inference batches
+    return AnimeGANBatcher(f"models/{model_name}.onnx", registry=warm_animegan_models())
+
+def get_animegan(model_name, tile_size=0):
+    if tile_size:
+        animegan = warm_animegan_models().get(f"models/{model_name}.onnx")
+        tile_workers, _ = animegan_thread_split(tile_size)
+        return functools.partial(animegan.tiled_inference, tile_size=tile_size, workers=tile_workers)
+    return get_animegan_batcher(model_name)
+
+def stylize_image(image, animegan, use_cpu=False, tile_size=0):
+    # No Streamlit calls in here, it runs on worker threads of add_animegan
+    if use_cpu and not tile_size:
         image = resize_image(image, 600)
         # image = reduce_image_resolution(image).resize_image(image, 300)
         # st.info("Image resolution reduced for CPU processing.")
@@ -113,46 +175,74 @@ def process_image(image, model_name, use_cpu=False):
     # Convert RGB to BGR (OpenCV format)
     img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
 
-    try:
-        animegan = AnimeGAN(f"models/{model_name}.onnx")
-        engine = Engine(show=False, custom_objects=[animegan])
-        
-        # Process the image without saving to file
-        result_array = engine.custom_processing(img_array)
-        
-        # Convert BGR back to RGB
-        result_array = cv2.cvtColor(result_array, cv2.COLOR_BGR2RGB)
-        
-        # Convert the result numpy array to PIL Image
-        result_image = Image.fromarray(result_array)
-        
-        if use_cpu:
-            result_image = result_image.resize(image.size, Image.LANCZOS)
-        
-        return result_image
-    except Exception as e:
-        st.error(f"Error processing image with {model_name}: {str(e)}")
-        return None
+    engine = Engine(show=False, custom_objects=[animegan])
+    
+    # Process the image without saving to file
+    result_array = engine.custom_processing(img_array)
+    
+    # Convert BGR back to RGB
+    result_array = cv2.cvtColor(result_array, cv2.COLOR_BGR2RGB)
+    
+    # Convert the result numpy array to PIL Image
+    result_image = Image.fromarray(result_array)
+    
+    if use_cpu and not tile_size:
+        result_image = result_image.resize(image.size, Image.LANCZOS)
+    
+    return result_image
 
-def add_animegan(image):
+def timed_stylize_image(image, animegan, use_cpu, tile_size):
+    start = time.perf_counter()
+    result_image = stylize_image(image, animegan, use_cpu, tile_size)
+    return result_image, time.perf_counter() - start
+
+def add_animegan(image, cache_key=None):
     use_cpu = not is_cuda_available()
     # if use_cpu:
     #     st.warning("CUDA is not available. Using CPU for processing with reduced image resolution.")
-
-    models = ['Hayao_64', 'Hayao-60', 'Paprika_54', 'Shinkai_53']
-
-
-    for model in models:
-        with st.spinner(f"Processing with {model}..."):
-            result_image = process_image(image, model, use_cpu)
-            if result_image is not None:
-                # st.subheader(f"Result for {model}")            
+    tile_size = int(os.getenv("ANIMEGAN_TILE_SIZE", 0))
+    cache = get_result_cache()
+
+    # Models are resolved here, st.cache_resource needs the script thread
+    animegans = {}
+    for model in ANIMEGAN_MODELS:
+        cached_image = cache.get_image(cache_key, f"animegan_{model}.png") if cache_key else None
+        if cached_image is not None:
+            with st.container(border=1):
+                st.image(cached_image, caption=f'Processed with {model}', use_column_width=True)
+            continue
+        try:
+            animegans[model] = get_animegan(model, tile_size)
+        except Exception as e:
+            st.error(f"Error processing image with {model}: {str(e)}")
+
+    if not animegans:
+        return
+
+    # Styles run concurrently, each result is shown as soon as it is ready
+    workers = max(1, min(len(animegans), os.cpu_count() or 1))
+    with st.spinner(f"Processing with {', '.join(animegans)}..."):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(timed_stylize_image, image, animegan, use_cpu, tile_size): model
+                for model, animegan in animegans.items()
+            }
+            for future in as_completed(futures):
+                model = futures[future]
+                try:
+                    result_image, elapsed = future.result()
+                except Exception as e:
+                    st.error(f"Error processing image with {model}: {str(e)}")
+                    continue
+                if cache_key:
+                    cache.put_image(cache_key, f"animegan_{model}.png", result_image)
                 with st.container(border=1):
-                    st.image(result_image, caption=f'Processed with {model}', use_column_width=True)
+                    st.image(result_image, caption=f'Processed with {model} ({elapsed:.1f}s)', use_column_width=True)
         
         
 async def main():
     title, image_path, footer_content = initialize()
+    warm_animegan_models()
     st.title("המרת תמונות לסקיצות אמנותיות")
 
    # Load and display the custom expander HTML
@@ -200,12 +290,20 @@ async def main():
                 st.error("נכשל בפענוח התמונה עם OpenCV. ייתכן שהקובץ פגום או בפורמט שאינו נתמך.")
                 return
             
+            cache = get_result_cache()
+            cache_key = get_cache_key(file_bytes)
             caption_placeholder = st.empty()
 
             with st.spinner('מתאר את תוכן התמונה...'):
-                captioning = ImageCaptioning()
-                english_captioning = captioning.get_image_captioning(image)
-                hebrew_captioning = translate_to_hebrew(english_captioning)
+                captions = cache.get_json(cache_key, "caption.json")
+                if captions is None:
+                    captioning = ImageCaptioning()
+                    english_captioning = captioning.get_image_captioning(image)
+                    hebrew_captioning = translate_to_hebrew(english_captioning)
+                    if english_captioning != 'No caption found':
+                        cache.put_json(cache_key, "caption.json", {"english": english_captioning, "hebrew": hebrew_captioning})
+                else:
+                    english_captioning, hebrew_captioning = captions["english"], captions["hebrew"]
                 caption_placeholder.success(hebrew_captioning)
 
             col1, col2 = st.columns(2)
@@ -215,8 +313,19 @@ async def main():
                     st.image(image_resized, caption="התמונה המקורית", use_column_width=True)
             
             with col2:
-                sketch = ImageToSketchProcessor.convert_to_sketch(opencv_image)
-                sketch_image = Image.fromarray(sketch)
+                sketch_style = st.radio("סגנון הסקיצה", list(SKETCH_VARIANTS), horizontal=True)
+                sketch_variant = SKETCH_VARIANTS[sketch_style]
+                sketch_image = cache.get_image(cache_key, f"{sketch_variant}.png")
+                if sketch_image is None:
+                    # All variants share grayscale and blur work, computing them together once per upload
+                    # makes switching the style a cache hit
+                    for variant, sketch in SketchVariantEngine().variants(opencv_image, SKETCH_VARIANTS.values()).items():
+                        if sketch.ndim == 3:
+                            sketch = cv2.cvtColor(sketch, cv2.COLOR_BGR2RGB)
+                        variant_image = Image.fromarray(sketch)
+                        cache.put_image(cache_key, f"{variant}.png", variant_image)
+                        if variant == sketch_variant:
+                            sketch_image = variant_image
                 sketch_resized = resize_image(sketch_image)
                 with st.container(border=1):
                     st.image(sketch_resized, caption="הסקיצה", use_column_width=True)
@@ -245,7 +354,7 @@ async def main():
 
             # Render AnimeGAN images only if they haven't been rendered yet
             if not st.session_state.animegan_images_rendered:
-                add_animegan(image)
+                add_animegan(image, cache_key)
                 st.session_state.animegan_images_rendered = True
 
             # שלב 2: בחירת סוג האנימציה            
@@ -269,8 +378,11 @@ async def main():
         for animation_type in selected_animations:
             if animation_type == "3D Rotation":
                 with st.spinner('יוצר תמונת אפקט סיבוב תלת מימד...'):
-                    image_effects = ImageEffects(sketch_resized, image_resized)
-                    gif_data = image_effects.rotation_3d()
+                    gif_data = cache.get_text(cache_key, f"rotation_3d_{sketch_variant}.gif.b64")
+                    if gif_data is None:
+                        image_effects = ImageEffects(sketch_resized, image_resized)
+                        gif_data = image_effects.rotation_3d()
+                        cache.put_text(cache_key, f"rotation_3d_{sketch_variant}.gif.b64", gif_data)
                     st.markdown(f'<img src="data:image/gif;base64,{gif_data}" alt="3D Rotation effect" width="100%">', unsafe_allow_html=True)
 
                     # Add download button for 3D Rotation
@@ -284,8 +396,11 @@ async def main():
             
             elif animation_type == "Smooth Transition":
                 with st.spinner('יוצר תמונת מעבר חלק...'):
-                    image_effects = ImageEffects(sketch_resized, image_resized)
-                    gif_data = image_effects.smooth_transition()
+                    gif_data = cache.get_text(cache_key, f"smooth_transition_{sketch_variant}.gif.b64")
+                    if gif_data is None:
+                        image_effects = ImageEffects(sketch_resized, image_resized)
+                        gif_data = image_effects.smooth_transition()
+                        cache.put_text(cache_key, f"smooth_transition_{sketch_variant}.gif.b64", gif_data)
                     st.markdown(f'<img src="data:image/gif;base64,{gif_data}" alt="Smooth Transition effect" width="100%">', unsafe_allow_html=True)
 
                     # Add download button for Smooth Transition
@@ -298,11 +413,16 @@ async def main():
             
             elif animation_type == "MP4 Transition":
                 with st.spinner('יוצר וידאו של מעבר חלק בין התמונות...'):
-                    animator = ImageTransitionAnimator(sketch_image=sketch_resized, color_image=image_resized)
-                    frames = animator.create_transition_frames()
-                    video_base64 = animator.create_video_in_memory(frames)
-                    uploader = ImgurUploader()                
-                    video_url = uploader.upload_media_to_imgur(video_base64, "video", english_captioning, hebrew_captioning)
+                    video = cache.get_json(cache_key, f"mp4_transition_{sketch_variant}.json")
+                    if video is None:
+                        animator = ImageTransitionAnimator(sketch_image=sketch_resized, color_image=image_resized)
+                        video_base64 = animator.create_video_in_memory(animator.iter_transition_frames())
+                        uploader = ImgurUploader()                
+                        video_url = uploader.upload_media_to_imgur(video_base64, "video", english_captioning, hebrew_captioning)
+                        if video_url:
+                            cache.put_json(cache_key, f"mp4_transition_{sketch_variant}.json", {"base64": video_base64, "url": video_url})
+                    else:
+                        video_base64, video_url = video["base64"], video["url"]
                     st.empty()  # Clear the placeholder
                     time.sleep(3)  # Small delay to ensure the placeholder is cleared
                     st.video(video_url, autoplay=True, loop=True)
@@ -1,12 +1,11 @@
-import base64
 import io
-import os
 import cv2
-import tempfile
 
 import numpy as np
 from PIL import Image
 
+from utils.streaming import MemoryVideoSink, drain
+
 class ImageTransitionAnimator:
     def __init__(self, sketch_image, color_image, duration=5, fps=30):
         self.sketch_image = self.prepare_image(sketch_image)
@@ -24,41 +23,21 @@ class ImageTransitionAnimator:
             raise ValueError("Unsupported image type")
 
     def create_transition_frames(self):
-        frames = []
+        return list(self.iter_transition_frames())
+
+    def iter_transition_frames(self):
+        # Frames are generated one at a time, so they can be encoded without keeping all of them
         for i in range(self.num_frames):
             alpha = i / self.num_frames
-            blend = cv2.addWeighted(self.sketch_image, 1 - alpha, self.color_image, alpha, 0)
-            frames.append(blend)
-        return frames
+            yield cv2.addWeighted(self.sketch_image, 1 - alpha, self.color_image, alpha, 0)
 
     def create_video_in_memory(self, frames):
-        height, width, _ = frames[0].shape
-        
-        # Create a temporary file in memory
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmpfile:
-            video_path = tmpfile.name  # Save the temp file path to access later
-        
-        # Now create the video using OpenCV's VideoWriter and save it to the temporary file
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(video_path, fourcc, self.fps, (width, height))
-
-        for frame in frames:
-            out.write(frame)
-        
-        # Ensure the VideoWriter is released properly
-        out.release()
-
-        # Read the video file from the temporary file into memory
-        with open(video_path, 'rb') as f:
-            video_bytes = f.read()
+        # frames can be a list or any iterable, e.g. iter_transition_frames()
+        sink = MemoryVideoSink(fps=self.fps)
+        drain(frames, sink)
         
         # Convert the video bytes to Base64
-        video_base64 = base64.b64encode(video_bytes).decode('utf-8')
-
-        # Clean up the temporary file
-        os.remove(video_path)
-
-        return video_base64
+        return sink.base64()
 
 # Example usage
 if __name__ == '__main__':
@@ -1,9 +1,163 @@
 # animegan.py
 import os
 import cv2
+import time
+import json
 import typing
+import hashlib
+import platform
+import threading
 import numpy as np
 import onnxruntime as ort
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+def create_session_options(
+    intra_op_num_threads: int = 0,
+    inter_op_num_threads: int = 0,
+    execution_mode: str = "sequential",
+    graph_optimization_level: str = "all",
+    enable_cpu_mem_arena: bool = True,
+    enable_mem_pattern: bool = True,
+    ) -> ort.SessionOptions:
+    """ Create onnxruntime SessionOptions from plain values
+
+    Args:
+        intra_op_num_threads: (int) - threads used inside a single operator, 0 lets onnxruntime use all cores
+        inter_op_num_threads: (int) - threads used to run independent operators, only used in parallel execution mode
+        execution_mode: (str) - "sequential" or "parallel"
+        graph_optimization_level: (str) - "disable", "basic", "extended" or "all"
+        enable_cpu_mem_arena: (bool) - whether to use onnxruntime memory arena for CPU allocations
+        enable_mem_pattern: (bool) - whether to preallocate memory based on recorded allocation pattern
+
+    Returns:
+        sess_options: (ort.SessionOptions) - session options to create InferenceSession with
+    """
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = intra_op_num_threads
+    sess_options.inter_op_num_threads = inter_op_num_threads
+    sess_options.execution_mode = EXECUTION_MODES[execution_mode]
+    sess_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization_level]
+    sess_options.enable_cpu_mem_arena = enable_cpu_mem_arena
+    sess_options.enable_mem_pattern = enable_mem_pattern
+    return sess_options
+
+def session_options_from_env() -> dict:
+    """ Read session tuning from environment, so replicas sharing a host can split cores between them
+    """
+    return {
+        "intra_op_num_threads": int(os.getenv("ORT_INTRA_OP_THREADS", 0)),
+        "inter_op_num_threads": int(os.getenv("ORT_INTER_OP_THREADS", 0)),
+        "execution_mode": os.getenv("ORT_EXECUTION_MODE", "sequential"),
+        "graph_optimization_level": os.getenv("ORT_GRAPH_OPTIMIZATION_LEVEL", "all"),
+        "enable_cpu_mem_arena": os.getenv("ORT_CPU_MEM_ARENA", "1") == "1",
+        "enable_mem_pattern": os.getenv("ORT_MEM_PATTERN", "1") == "1",
+    }
+
+def create_session(
+    model_path: str,
+    providers: typing.Optional[typing.List[str]] = None,
+    session_options: typing.Optional[dict] = None,
+    optimized_cache_dir: typing.Optional[str] = None,
+    ) -> ort.InferenceSession:
+    """ Create InferenceSession, optionally reusing graph optimized by a previous process
+
+    Optimized graph is cached per model file, onnxruntime version, providers, optimization level and host,
+    because level "all" bakes in CPU specific kernels. Cached graph is loaded with optimizations disabled so process start skips re-optimization.
+
+    Args:
+        model_path: (str) - path to onnx model file
+        providers: (typing.List[str]) - execution providers, defaults to CPUExecutionProvider
+        session_options: (dict) - keyword arguments for create_session_options
+        optimized_cache_dir: (str) - folder to store optimized graphs in, caching is disabled if None
+
+    Returns:
+        ort_sess: (ort.InferenceSession) - created session
+    """
+    providers = providers or ['CPUExecutionProvider']
+    session_options = dict(session_options or {})
+    sess_options = create_session_options(**session_options)
+
+    if not optimized_cache_dir or session_options.get("graph_optimization_level") == "disable":
+        return ort.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+
+    stat = os.stat(model_path)
+    signature = f"{os.path.abspath(model_path)}|{stat.st_size}|{stat.st_mtime_ns}|{ort.__version__}|{providers}|{sess_options.graph_optimization_level}|{platform.node()}|{platform.machine()}"
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    cached_path = os.path.join(optimized_cache_dir, f"{name}-{hashlib.sha1(signature.encode()).hexdigest()[:16]}.onnx")
+
+    if os.path.exists(cached_path):
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return ort.InferenceSession(cached_path, sess_options=sess_options, providers=providers)
+        except Exception:
+            # Corrupted or incompatible cache entry, rebuild it from the source model
+            os.remove(cached_path)
+            sess_options = create_session_options(**session_options)
+
+    os.makedirs(optimized_cache_dir, exist_ok=True)
+    # Write to a process specific file first, replicas starting together must not read a half written graph
+    tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+    sess_options.optimized_model_filepath = tmp_path
+    ort_sess = ort.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+    if os.path.exists(tmp_path):
+        os.replace(tmp_path, cached_path)
+
+    return ort_sess
+
+
+PRECISIONS = ("fp32", "fp16", "int8-dynamic", "int8-static")
+QUANTIZATION_REPORT = "quantization_report.json"
+
+def variant_path(model_path: str, precision: str) -> str:
+    """ Path of model variant produced by utils/animegan_quantization.py, e.g. models/Hayao_64.int8-static.onnx
+    """
+    if precision == "fp32":
+        return model_path
+    root, extension = os.path.splitext(model_path)
+    return f"{root}.{precision}{extension}"
+
+def resolve_precision(model_path: str, precision: str = "fp32", min_psnr: float = 30.0) -> str:
+    """ Pick model variant for given precision policy, falls back to fp32 when the variant doesn't exist
+
+    Args:
+        model_path: (str) - path to fp32 onnx model file
+        precision: (str) - one of PRECISIONS or "auto" to pick the fastest variant from quantization report
+        min_psnr: (float) - with "auto", minimum PSNR against fp32 output a variant must reach to be picked
+
+    Returns:
+        model_path: (str) - path to model variant to load
+    """
+    if precision == "auto":
+        report_path = os.path.join(os.path.dirname(model_path), QUANTIZATION_REPORT)
+        if not os.path.exists(report_path):
+            return model_path
+        with open(report_path, 'r') as f:
+            report = json.load(f).get(os.path.basename(model_path), {})
+        candidates = [
+            (result["latency_ms"], name) for name, result in report.items()
+            if name == "fp32" or result.get("psnr", 0) >= min_psnr
+        ]
+        precision = min(candidates)[1] if candidates else "fp32"
+
+    if precision not in PRECISIONS:
+        raise Exception(f"Unknown precision {precision}, expected one of {PRECISIONS} or auto")
+
+    path = variant_path(model_path, precision)
+    return path if os.path.exists(path) else model_path
+
 
 class AnimeGAN:
     """ Object to image animation using AnimeGAN models
@@ -20,22 +174,67 @@ class AnimeGAN:
         self,
         model_path: str = '',
         downsize_ratio: float = 1.0,
+        tile_size: int = 0,
+        tile_overlap: int = 32,
+        tile_workers: int = 1,
+        providers: typing.Optional[typing.List[str]] = None,
+        session_options: typing.Optional[dict] = None,
+        optimized_cache_dir: typing.Optional[str] = None,
+        precision: str = "fp32",
+        min_psnr: float = 30.0,
+        fused_io: bool = False,
+        backend: str = "onnxruntime",
+        calibration_shapes: typing.Iterable[typing.Tuple[int, int]] = ((512, 512),),
         ) -> None:
         """
         Args:
             model_path: (str) - path to onnx model file
             downsize_ratio: (float) - ratio to downsize input frame for faster inference
+            tile_size: (int) - if set, frames larger than tile_size are processed at full resolution in tiles of this size
+            tile_overlap: (int) - overlap between neighbouring tiles which is feathered to hide seams
+            tile_workers: (int) - number of tiles to run in parallel
+            providers: (typing.List[str]) - onnxruntime execution providers, defaults to CPUExecutionProvider
+            session_options: (dict) - session tuning, keyword arguments for create_session_options
+            optimized_cache_dir: (str) - folder to cache optimized graph in to skip re-optimization on later starts
+            precision: (str) - model variant to load: "fp32", "fp16", "int8-dynamic", "int8-static" or "auto"
+            min_psnr: (float) - with precision "auto", minimum PSNR against fp32 a quantized variant must reach
+            fused_io: (bool) - load model with normalization fused into graph (created with utils/animegan_graph.py
+                if missing), frames are then fed and returned as uint8 without float copies in Python
+            backend: (str) - "onnxruntime", "opencv", "openvino" or "auto" to pick fastest one by micro-benchmark
+            calibration_shapes: (typing.Iterable) - with backend "auto", (height, width) input sizes to benchmark at
+                start, other sizes use the choice of the calibrated size closest by pixel count
         """
         if not os.path.exists(model_path):
             raise Exception(f"Model doesn't exists in {model_path}")
         
         self.downsize_ratio = downsize_ratio
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_workers = tile_workers
 
-        providers = ['CUDAExecutionProvider'] if ort.get_device() == "GPU" else ['CPUExecutionProvider']
+        self.model_path = resolve_precision(model_path, precision, min_psnr)
+        if fused_io:
+            from utils.animegan_graph import fuse_uint8_io, fused_io_path
+            fused_path = fused_io_path(self.model_path)
+            self.model_path = fused_path if os.path.exists(fused_path) else fuse_uint8_io(self.model_path, fused_path)
 
-        # self.ort_sess = ort.InferenceSession(model_path, providers=providers)
-        # Explicitly use CPU provider
-        self.ort_sess = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        from utils.animegan_backends import create_backend, select_backend
+        session_kwargs = {"providers": providers, "session_options": session_options, "optimized_cache_dir": optimized_cache_dir}
+        self.backends = {}
+        self.backend_choices = {}
+        if backend == "auto":
+            calibration_shapes = [tuple(shape) for shape in calibration_shapes]
+            for shape in calibration_shapes:
+                self.backend_choices[shape] = select_backend(self.model_path, shape, backends=self.backends, **session_kwargs)
+            # Keep only backends that won for some size
+            self.backends = {name: self.backends[name] for name in set(self.backend_choices.values())}
+            self.backend = self.backends[self.backend_choices[calibration_shapes[0]]]
+        else:
+            self.backend = self.backends[backend] = create_backend(backend, self.model_path, **session_kwargs)
+
+        self.ort_sess = getattr(self.backend, "ort_sess", None)
+        # Models prepared with fuse_uint8_io take and return uint8 frames
+        self.uint8_io = self.backend.uint8_io
 
     def to_32s(self, x):
         return 256 if x < 256 else x - x%32
@@ -53,6 +252,8 @@ class AnimeGAN:
         h, w = frame.shape[:2]
         if x32: # resize image to multiple of 32s
             frame = cv2.resize(frame, (self.to_32s(int(w*self.downsize_ratio)), self.to_32s(int(h*self.downsize_ratio))))
+        if self.uint8_io:
+            return np.ascontiguousarray(frame)
         frame = frame.astype(np.float32) / 127.5 - 1.0
         return frame
 
@@ -66,9 +267,13 @@ class AnimeGAN:
         Returns:
             frame: (np.ndarray) - original size animated image
         """
-        frame = (frame.squeeze() + 1.) / 2 * 255
-        frame = frame.astype(np.uint8)
-        frame = cv2.resize(frame, (wh[0], wh[1]))
+        if self.uint8_io:
+            frame = frame.squeeze()
+        else:
+            frame = (frame.squeeze() + 1.) / 2 * 255
+            frame = frame.astype(np.uint8)
+        if frame.shape[1::-1] != tuple(wh):
+            frame = cv2.resize(frame, (wh[0], wh[1]))
         return frame
 
     def __call__(self, frame: np.ndarray) -> np.ndarray:
@@ -80,8 +285,387 @@ class AnimeGAN:
         Returns:
             frame: (np.ndarray) - processed frame with face detection
         """
+        if self.tile_size and max(frame.shape[:2]) > self.tile_size:
+            return self.tiled_inference(frame)
+
         image = self.process_frame(frame)
-        outputs = self.ort_sess.run(None, {self.ort_sess._inputs_meta[0].name: np.expand_dims(image, axis=0)})
+        outputs = self.run_batch(np.expand_dims(image, axis=0))
         frame = self.post_process(outputs[0], frame.shape[:2][::-1])
  
         return frame
+
+    def run_batch(self, images: np.ndarray) -> np.ndarray:
+        """ Run model on a batch of already processed frames
+
+        Args:
+            images: (np.ndarray) - NHWC batch of frames returned by process_frame, all of the same shape
+
+        Returns:
+            outputs: (np.ndarray) - NHWC batch of raw model outputs
+        """
+        return self.select_backend(images.shape[1:3]).run(images)
+
+    def select_backend(self, shape: typing.Tuple[int, int]):
+        """ Backend calibrated for the size closest to shape (height, width) by pixel count
+        """
+        if len(self.backend_choices) < 2:
+            return self.backend
+        pixels = shape[0] * shape[1]
+        closest = min(self.backend_choices, key=lambda calibrated: abs(calibrated[0] * calibrated[1] - pixels))
+        return self.backends[self.backend_choices[closest]]
+
+    @staticmethod
+    def _tile_starts(length: int, tile: int, stride: int) -> typing.List[int]:
+        """ Start positions of tiles covering length, the last tile is aligned to the end
+        """
+        if length <= tile:
+            return [0]
+        starts = list(range(0, length - tile, stride))
+        starts.append(length - tile)
+        return starts
+
+    @staticmethod
+    def _feather(length: int, overlap: int, first: bool, last: bool) -> np.ndarray:
+        """ 1D blending weights, linear ramp over overlap on sides shared with neighbouring tiles
+        """
+        weights = np.ones(length, np.float32)
+        ramp = np.linspace(1. / (overlap + 1), 1., overlap, dtype=np.float32)
+        if not first:
+            weights[:overlap] = ramp
+        if not last:
+            weights[length - overlap:] = ramp[::-1]
+        return weights
+
+    def tiled_inference(
+        self,
+        frame: np.ndarray,
+        tile_size: typing.Optional[int] = None,
+        overlap: typing.Optional[int] = None,
+        workers: typing.Optional[int] = None,
+        ) -> np.ndarray:
+        """ Process frame at full resolution in overlapping 32 aligned tiles with feathered seams
+
+        Tiles are processed one row band at a time and finished rows are written to the output right away,
+        so besides the output itself memory is bounded by tile_size and the frame width.
+
+        Args:
+            frame: (np.ndarray) - frame to process
+            tile_size: (int) - tile size, defaults to self.tile_size
+            overlap: (int) - overlap between tiles, defaults to self.tile_overlap
+            workers: (int) - number of tiles to run in parallel, defaults to self.tile_workers
+
+        Returns:
+            frame: (np.ndarray) - animated frame of original size
+        """
+        tile_size = tile_size or self.tile_size or 512
+        overlap = self.tile_overlap if overlap is None else overlap
+        workers = workers or self.tile_workers
+
+        tile = max(256, tile_size - tile_size % 32)
+        overlap = min(max(32, overlap - overlap % 32), tile // 2)
+
+        # Pad frame to multiple of 32s instead of resizing it
+        h, w = frame.shape[:2]
+        pad_h, pad_w = (-h) % 32, (-w) % 32
+        padded = cv2.copyMakeBorder(frame, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101) if pad_h or pad_w else frame
+        ph, pw = padded.shape[:2]
+        th, tw = min(tile, ph), min(tile, pw)
+
+        ys = self._tile_starts(ph, th, th - overlap)
+        xs = self._tile_starts(pw, tw, tw - overlap)
+        weights_x = [self._feather(tw, overlap, i == 0, i == len(xs) - 1) for i in range(len(xs))]
+
+        def run_tile(x):
+            image = self.process_frame(padded[y:y + th, x:x + tw], x32=False)
+            output = self.run_batch(image[None])[0]
+            if output.shape[:2] != (th, tw):
+                output = cv2.resize(output, (tw, th))
+            if self.uint8_io:
+                return output.astype(np.float32)
+            return (output + 1.) * 127.5
+
+        result = np.empty((ph, pw, 3), np.uint8)
+        band = np.zeros((th, pw, 3), np.float32)
+        band_weights = np.zeros((th, pw, 1), np.float32)
+        band_start = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for j, y in enumerate(ys):
+                # Rows above current tile row can't be touched anymore, flush them and shift band buffer
+                shift = y - band_start
+                if shift:
+                    result[band_start:y] = np.clip(band[:shift] / band_weights[:shift], 0, 255)
+                    band[:th - shift] = band[shift:]
+                    band[th - shift:] = 0
+                    band_weights[:th - shift] = band_weights[shift:]
+                    band_weights[th - shift:] = 0
+                    band_start = y
+
+                weights_y = self._feather(th, overlap, j == 0, j == len(ys) - 1)
+                for i, output in enumerate(executor.map(run_tile, xs)):
+                    weights = np.outer(weights_y, weights_x[i])[..., None]
+                    band[:, xs[i]:xs[i] + tw] += output * weights
+                    band_weights[:, xs[i]:xs[i] + tw] += weights
+
+        result[band_start:] = np.clip(band[:ph - band_start] / band_weights[:ph - band_start], 0, 255)
+
+        return result[:h, :w]
+
+
+class AnimeGANRegistry:
+    """ Process-wide cache of warm AnimeGAN sessions shared across Streamlit sessions and reruns
+
+    Loading an onnx model (and optimizing its graph) is more expensive than running it on CPU,
+    so sessions are kept alive and evicted least-recently-used when memory_budget_mb is exceeded.
+    """
+    def __init__(
+        self,
+        memory_budget_mb: float = 1024,
+        memory_factor: float = 3.0,
+        animegan_kwargs: typing.Optional[dict] = None,
+        ) -> None:
+        """
+        Args:
+            memory_budget_mb: (float) - approximate memory budget for all loaded sessions in megabytes
+            memory_factor: (float) - multiplier applied to the onnx file size to estimate session memory
+            animegan_kwargs: (dict) - keyword arguments used to create every AnimeGAN, e.g. session_options
+        """
+        self.animegan_kwargs = animegan_kwargs or {}
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.memory_factor = memory_factor
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+        self._model_locks = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "load_time": 0.0}
+
+    def estimate_size(self, model_path: str) -> int:
+        """ Estimate memory used by a loaded session from the size of its model file
+        """
+        return int(os.path.getsize(model_path) * self.memory_factor)
+
+    def _model_lock(self, model_path: str) -> threading.Lock:
+        with self._lock:
+            return self._model_locks.setdefault(model_path, threading.Lock())
+
+    def _evict(self, required: int) -> None:
+        """ Drop least-recently-used sessions until required bytes fit into memory budget
+        """
+        while self._sessions and sum(self._sizes.values()) + required > self.memory_budget:
+            model_path, _ = self._sessions.popitem(last=False)
+            self._sizes.pop(model_path, None)
+            self.stats["evictions"] += 1
+
+    def get(self, model_path: str) -> AnimeGAN:
+        """ Return warm AnimeGAN for model_path, loading it on first use
+
+        Args:
+            model_path: (str) - path to onnx model file
+
+        Returns:
+            animegan: (AnimeGAN) - shared AnimeGAN object
+        """
+        with self._lock:
+            if model_path in self._sessions:
+                self._sessions.move_to_end(model_path)
+                self.stats["hits"] += 1
+                return self._sessions[model_path]
+
+        # Load outside the registry lock so different models can load concurrently
+        with self._model_lock(model_path):
+            with self._lock:
+                if model_path in self._sessions:
+                    self._sessions.move_to_end(model_path)
+                    self.stats["hits"] += 1
+                    return self._sessions[model_path]
+                self.stats["misses"] += 1
+
+            start = time.perf_counter()
+            animegan = AnimeGAN(model_path, **self.animegan_kwargs)
+            load_time = time.perf_counter() - start
+
+            size = self.estimate_size(animegan.model_path)
+            with self._lock:
+                self.stats["load_time"] += load_time
+                self._evict(size)
+                self._sessions[model_path] = animegan
+                self._sizes[model_path] = size
+
+        return animegan
+
+    def warm(self, model_paths: typing.Iterable[str]) -> None:
+        """ Load given models ahead of the first request, missing model files are skipped
+        """
+        for model_path in model_paths:
+            if os.path.exists(model_path):
+                self.get(model_path)
+
+    def loaded(self) -> typing.List[str]:
+        """ Return model paths of currently loaded sessions, least recently used first
+        """
+        with self._lock:
+            return list(self._sessions.keys())
+
+    def report(self) -> dict:
+        """ Return hit/miss/eviction counters, total load time and estimated memory usage
+        """
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "loaded": list(self._sessions.keys()),
+                "memory_used_mb": sum(self._sizes.values()) / 1024 / 1024,
+                "memory_budget_mb": self.memory_budget / 1024 / 1024,
+            }
+
+
+class AnimeGANBatcher:
+    """ Dynamic micro-batching front-end for AnimeGAN
+
+    Frames submitted from many threads are grouped by their processed shape and run as one batch,
+    a batch is dispatched when it reaches max_batch_size or when its oldest frame waited max_wait_ms.
+    """
+    def __init__(
+        self,
+        model_path: str,
+        registry: typing.Optional[AnimeGANRegistry] = None,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        ) -> None:
+        """
+        Args:
+            model_path: (str) - path to onnx model file, resolved through registry on every batch
+            registry: (AnimeGANRegistry) - registry to take AnimeGAN from, defaults to process-wide registry
+            max_batch_size: (int) - maximum number of frames run in one inference
+            max_wait_ms: (float) - maximum time the oldest queued frame waits for the batch to fill up
+        """
+        self.model_path = model_path
+        self.registry = registry or get_registry()
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self.stats = {"batches": 0, "frames": 0, "max_batch": 0}
+
+        self._worker = threading.Thread(target=self._run, name=f"AnimeGANBatcher-{os.path.basename(model_path)}", daemon=True)
+        self._worker.start()
+
+    def submit(self, frame: np.ndarray) -> Future:
+        """ Queue frame for batched inference
+
+        Args:
+            frame: (np.ndarray) - frame to animate
+
+        Returns:
+            future: (Future) - resolves to the animated frame of original size
+        """
+        future = Future()
+        image = self.registry.get(self.model_path).process_frame(frame)
+        with self._condition:
+            if self._closed:
+                raise Exception("AnimeGANBatcher is closed")
+            self._pending.append((time.perf_counter(), image, frame.shape[:2][::-1], future))
+            self._condition.notify()
+
+        return future
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        """ Blocking call, allows to use batcher as Engine custom object
+        """
+        return self.submit(frame).result()
+
+    def _next_batch(self) -> typing.Optional[list]:
+        """ Wait for the oldest pending frame and collect same-shape frames up to max_batch_size or max_wait
+        """
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return None
+
+            shape = self._pending[0][1].shape
+            deadline = self._pending[0][0] + self.max_wait
+            while not self._closed:
+                same_shape = sum(1 for item in self._pending if item[1].shape == shape)
+                remaining = deadline - time.perf_counter()
+                if same_shape >= self.max_batch_size or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch, rest = [], []
+            for item in self._pending:
+                if item[1].shape == shape and len(batch) < self.max_batch_size:
+                    batch.append(item)
+                else:
+                    rest.append(item)
+            self._pending = rest
+
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                animegan = self.registry.get(self.model_path)
+                images = np.stack([item[1] for item in batch])
+                try:
+                    outputs = animegan.run_batch(images)
+                except Exception:
+                    # Models exported with a fixed batch dimension of 1 can't run batched
+                    if len(batch) == 1:
+                        raise
+                    outputs = [animegan.run_batch(image[None])[0] for image in images]
+
+                for (_, _, wh, future), output in zip(batch, outputs):
+                    future.set_result(animegan.post_process(output, wh))
+            except Exception as e:
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+
+            self.stats["batches"] += 1
+            self.stats["frames"] += len(batch)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+
+    def close(self) -> None:
+        """ Stop worker thread after already queued frames are processed
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._worker.join()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry(session_options: typing.Optional[dict] = None) -> AnimeGANRegistry:
+    """ Return process-wide AnimeGANRegistry configured from environment
+    (ANIMEGAN_MEMORY_BUDGET_MB, ANIMEGAN_OPTIMIZED_CACHE_DIR, ANIMEGAN_PRECISION, ANIMEGAN_FUSED_IO, ANIMEGAN_BACKEND and ORT_* session tuning)
+
+    Args:
+        session_options: (dict) - session options overriding ORT_* environment, only used by the call that creates the registry
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = AnimeGANRegistry(
+                memory_budget_mb=float(os.getenv("ANIMEGAN_MEMORY_BUDGET_MB", 1024)),
+                animegan_kwargs={
+                    "session_options": {**session_options_from_env(), **(session_options or {})},
+                    "optimized_cache_dir": os.getenv("ANIMEGAN_OPTIMIZED_CACHE_DIR", "models/.optimized"),
+                    "precision": os.getenv("ANIMEGAN_PRECISION", "fp32"),
+                    "fused_io": os.getenv("ANIMEGAN_FUSED_IO", "0") == "1",
+                    "backend": os.getenv("ANIMEGAN_BACKEND", "onnxruntime"),
+                },
+            )
+        return _registry
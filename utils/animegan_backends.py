@@ -0,0 +1,174 @@
+# animegan_backends.py
+""" Interchangeable inference backends for AnimeGAN onnx models and benchmark based backend selection
+"""
+import os
+import json
+import time
+import typing
+import platform
+import threading
+import numpy as np
+
+from utils.animegan import create_session
+
+class OnnxRuntimeBackend:
+    """ onnxruntime InferenceSession, see animegan.create_session for arguments
+    """
+    name = "onnxruntime"
+
+    def __init__(
+        self,
+        model_path: str,
+        providers: typing.Optional[typing.List[str]] = None,
+        session_options: typing.Optional[dict] = None,
+        optimized_cache_dir: typing.Optional[str] = None,
+        ) -> None:
+        self.ort_sess = create_session(model_path, providers, session_options, optimized_cache_dir)
+        self.input_name = self.ort_sess.get_inputs()[0].name
+        self.uint8_io = self.ort_sess.get_inputs()[0].type == 'tensor(uint8)'
+
+    def run(self, images: np.ndarray) -> np.ndarray:
+        return self.ort_sess.run(None, {self.input_name: images})[0]
+
+
+class OpenCVBackend:
+    """ OpenCV DNN module running onnx model on CPU
+    """
+    name = "opencv"
+
+    def __init__(self, model_path: str, **kwargs) -> None:
+        import cv2
+        self.net = cv2.dnn.readNetFromONNX(model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.uint8_io = model_path.endswith(".uint8io.onnx")
+        # cv2.dnn.Net isn't safe to run from several threads at once
+        self._lock = threading.Lock()
+
+    def run(self, images: np.ndarray) -> np.ndarray:
+        with self._lock:
+            self.net.setInput(images)
+            return self.net.forward()
+
+
+class OpenVINOBackend:
+    """ OpenVINO CPU plugin, requires optional openvino package
+    """
+    name = "openvino"
+
+    def __init__(self, model_path: str, **kwargs) -> None:
+        try:
+            import openvino as ov
+        except ImportError:
+            raise Exception("OpenVINO backend requires openvino package")
+        core = ov.Core()
+        model = core.read_model(model_path)
+        self.uint8_io = model.inputs[0].get_element_type() == ov.Type.u8
+        self.compiled = core.compile_model(model, "CPU")
+        self.output = self.compiled.output(0)
+
+    def run(self, images: np.ndarray) -> np.ndarray:
+        # A new infer request per call keeps concurrent callers independent
+        return self.compiled.create_infer_request().infer([images])[self.output]
+
+
+BACKENDS = {
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+    OpenCVBackend.name: OpenCVBackend,
+    OpenVINOBackend.name: OpenVINOBackend,
+}
+
+def create_backend(name: str, model_path: str, **kwargs):
+    """ Create backend by name, kwargs are onnxruntime session arguments and ignored by other backends
+    """
+    if name not in BACKENDS:
+        raise Exception(f"Unknown backend {name}, expected one of {list(BACKENDS)}")
+    return BACKENDS[name](model_path, **kwargs)
+
+def host_signature() -> str:
+    """ Backends are ranked per host, different CPUs in the fleet favour different backends
+    """
+    return f"{platform.node()}|{platform.machine()}|{platform.processor()}|{os.cpu_count()}"
+
+def benchmark_backend(backend, input_shape: typing.Tuple[int, int], runs: int = 3) -> float:
+    """ Median latency in seconds of backend on random frame of input_shape (height, width)
+    """
+    dtype = np.uint8 if backend.uint8_io else np.float32
+    image = np.random.uniform(0, 255 if backend.uint8_io else 1, (1, *input_shape, 3)).astype(dtype)
+    backend.run(image)  # warm up, first run allocates memory and may compile kernels
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.run(image)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+def select_backend(
+    model_path: str,
+    input_shape: typing.Tuple[int, int],
+    candidates: typing.Iterable[str] = tuple(BACKENDS),
+    runs: int = 3,
+    cache_path: typing.Optional[str] = None,
+    backends: typing.Optional[dict] = None,
+    **kwargs,
+    ) -> str:
+    """ Pick fastest backend for model and input size with a short micro-benchmark, the choice is cached on disk
+
+    Args:
+        model_path: (str) - path to onnx model file
+        input_shape: (typing.Tuple[int, int]) - (height, width) of processed frame
+        candidates: (typing.Iterable[str]) - backend names to try, unavailable backends are skipped
+        runs: (int) - timed runs per backend
+        cache_path: (str) - json file to keep choices in, defaults to backend_choices.json next to model
+        backends: (dict) - already created backends by name, created backends (also the cached choice) are added to it
+        kwargs: - onnxruntime session arguments
+
+    Returns:
+        name: (str) - name of fastest backend
+    """
+    cache_path = cache_path or os.path.join(os.path.dirname(model_path), "backend_choices.json")
+    stat = os.stat(model_path)
+    key = f"{os.path.basename(model_path)}|{stat.st_size}|{stat.st_mtime_ns}|{input_shape[0]}x{input_shape[1]}|{host_signature()}"
+
+    choices = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                choices = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            choices = {}
+    backends = {} if backends is None else backends
+    if choices.get(key) in candidates:
+        name = choices[key]
+        try:
+            if name not in backends:
+                backends[name] = create_backend(name, model_path, **kwargs)
+            return name
+        except Exception as e:
+            # Cached choice no longer works on this setup, benchmark again
+            print(f"Backend {name} unavailable for {model_path}: {e}")
+
+    timings = {}
+    for name in candidates:
+        try:
+            if name not in backends:
+                backends[name] = create_backend(name, model_path, **kwargs)
+            timings[name] = benchmark_backend(backends[name], input_shape, runs)
+        except Exception as e:
+            # Backend not installed or doesn't support the model, e.g. dynamic shapes in OpenCV DNN
+            print(f"Backend {name} unavailable for {model_path}: {e}")
+
+    if not timings:
+        raise Exception(f"No backend could run {model_path}")
+
+    name = min(timings, key=timings.get)
+    choices[key] = name
+    try:
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(choices, f, indent=2)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+    return name
@@ -0,0 +1,85 @@
+# animegan_graph.py
+""" Model preparation steps that rewrite AnimeGAN onnx graphs
+
+Usage:
+    python -m utils.animegan_graph models/Hayao_64.onnx models/Shinkai_53.onnx
+"""
+import os
+import sys
+import onnx
+from onnx import TensorProto, helper
+
+def fused_io_path(model_path: str) -> str:
+    """ Path of model with normalization fused into the graph, e.g. models/Hayao_64.uint8io.onnx
+    """
+    root, extension = os.path.splitext(model_path)
+    return f"{root}.uint8io{extension}"
+
+def fuse_uint8_io(model_path: str, output_path: str = None) -> str:
+    """ Move AnimeGAN pre and post processing into the onnx graph
+
+    The fused model takes uint8 NHWC frame and returns uint8 NHWC frame:
+        input: x / 127.5 - 1.0 (same as AnimeGAN.process_frame)
+        output: clip((y + 1.0) * 127.5, 0, 255) cast to uint8 (same as AnimeGAN.post_process)
+    so no float copies of the frame are created in Python.
+
+    Args:
+        model_path: (str) - path to onnx model with float32 input and output
+        output_path: (str) - where to save fused model, defaults to fused_io_path(model_path)
+
+    Returns:
+        output_path: (str) - path to fused model
+    """
+    output_path = output_path or fused_io_path(model_path)
+    model = onnx.load(model_path)
+    graph = model.graph
+
+    graph_input, graph_output = graph.input[0], graph.output[0]
+    if graph_input.type.tensor_type.elem_type == TensorProto.UINT8:
+        raise Exception(f"Model {model_path} already takes uint8 input")
+
+    input_name, output_name = graph_input.name, graph_output.name
+    input_dims = [d.dim_param or d.dim_value for d in graph_input.type.tensor_type.shape.dim]
+    output_dims = [d.dim_param or d.dim_value for d in graph_output.type.tensor_type.shape.dim]
+
+    graph.initializer.extend([
+        helper.make_tensor("animegan_scale", TensorProto.FLOAT, [], [127.5]),
+        helper.make_tensor("animegan_one", TensorProto.FLOAT, [], [1.0]),
+        helper.make_tensor("animegan_min", TensorProto.FLOAT, [], [0.0]),
+        helper.make_tensor("animegan_max", TensorProto.FLOAT, [], [255.0]),
+    ])
+
+    # Original input becomes an intermediate value produced by normalization nodes
+    preprocess = [
+        helper.make_node("Cast", [f"{input_name}_uint8"], [f"{input_name}_float"], to=TensorProto.FLOAT),
+        helper.make_node("Div", [f"{input_name}_float", "animegan_scale"], [f"{input_name}_scaled"]),
+        helper.make_node("Sub", [f"{input_name}_scaled", "animegan_one"], [input_name]),
+    ]
+    postprocess = [
+        helper.make_node("Add", [output_name, "animegan_one"], [f"{output_name}_shifted"]),
+        helper.make_node("Mul", [f"{output_name}_shifted", "animegan_scale"], [f"{output_name}_scaled"]),
+        helper.make_node("Clip", [f"{output_name}_scaled", "animegan_min", "animegan_max"], [f"{output_name}_clipped"]),
+        helper.make_node("Cast", [f"{output_name}_clipped"], [f"{output_name}_uint8"], to=TensorProto.UINT8),
+    ]
+
+    nodes = preprocess + list(graph.node) + postprocess
+    del graph.node[:]
+    graph.node.extend(nodes)
+
+    del graph.input[0]
+    graph.input.insert(0, helper.make_tensor_value_info(f"{input_name}_uint8", TensorProto.UINT8, input_dims))
+    del graph.output[0]
+    graph.output.insert(0, helper.make_tensor_value_info(f"{output_name}_uint8", TensorProto.UINT8, output_dims))
+
+    onnx.checker.check_model(model)
+    # Write to a process specific file first, AnimeGAN treats an existing fused model file as complete
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    onnx.save(model, tmp_path)
+    os.replace(tmp_path, output_path)
+
+    return output_path
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print(f"{path} -> {fuse_uint8_io(path)}")
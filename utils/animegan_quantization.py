@@ -0,0 +1,275 @@
+# animegan_quantization.py
+""" Produce quantized AnimeGAN model variants and a report of their latency, memory and accuracy
+
+Usage:
+    python -m utils.animegan_quantization --models models/Hayao_64.onnx models/Shinkai_53.onnx
+
+Variants are written next to the fp32 model (see animegan.variant_path) and the report is written to
+models/quantization_report.json, which AnimeGAN reads when created with precision="auto".
+"""
+import gc
+import os
+import cv2
+import json
+import time
+import typing
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+import numpy as np
+import onnxruntime as ort
+from concurrent.futures import ProcessPoolExecutor
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from utils.animegan import PRECISIONS, QUANTIZATION_REPORT, variant_path
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+def load_images(folders: typing.Iterable[str], size: typing.Tuple[int, int] = (256, 256)) -> typing.List[np.ndarray]:
+    """ Load images from folders resized to size, used both for calibration and evaluation
+    """
+    images = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for file_name in sorted(os.listdir(folder)):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                image = cv2.imread(os.path.join(folder, file_name))
+                if image is not None:
+                    images.append(cv2.resize(image, size))
+    return images
+
+def normalize(image: np.ndarray) -> np.ndarray:
+    """ Same normalization as AnimeGAN.process_frame, returned as batch of one
+    """
+    return (image.astype(np.float32) / 127.5 - 1.0)[None]
+
+def denormalize(output: np.ndarray) -> np.ndarray:
+    return np.clip((output.squeeze() + 1.) / 2 * 255, 0, 255).astype(np.uint8)
+
+
+class ImageCalibrationReader(CalibrationDataReader):
+    """ Feed calibration images to onnxruntime static quantization
+    """
+    def __init__(self, model_path: str, images: typing.List[np.ndarray]) -> None:
+        session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        self.input_name = session.get_inputs()[0].name
+        self.images = iter(images)
+
+    def get_next(self) -> typing.Optional[dict]:
+        image = next(self.images, None)
+        if image is None:
+            return None
+        return {self.input_name: normalize(image)}
+
+
+def quantize_model(model_path: str, precision: str, calibration_images: typing.List[np.ndarray]) -> str:
+    """ Create model variant for given precision
+
+    Args:
+        model_path: (str) - path to fp32 onnx model
+        precision: (str) - "fp16", "int8-dynamic" or "int8-static"
+        calibration_images: (typing.List[np.ndarray]) - images used to calibrate activation ranges for int8-static
+
+    Returns:
+        output_path: (str) - path to created model variant
+    """
+    output_path = variant_path(model_path, precision)
+    # Write to a process specific file first, AnimeGAN treats an existing variant file as complete
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+
+    if precision == "int8-dynamic":
+        quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QUInt8)
+
+    elif precision == "int8-static":
+        if not calibration_images:
+            raise Exception("Static quantization requires calibration images")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Shape inference and graph cleanup let the quantizer cover more operators
+            preprocessed_path = os.path.join(tmp_dir, "preprocessed.onnx")
+            quant_pre_process(model_path, preprocessed_path, skip_symbolic_shape=True)
+            quantize_static(
+                preprocessed_path,
+                tmp_path,
+                ImageCalibrationReader(preprocessed_path, calibration_images),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+            )
+
+    elif precision == "fp16":
+        try:
+            import onnx
+            from onnxconverter_common import float16
+        except ImportError:
+            raise Exception("fp16 conversion requires onnx and onnxconverter-common packages")
+        model = float16.convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+        onnx.save(model, tmp_path)
+
+    else:
+        raise Exception(f"Unknown precision {precision}")
+
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def psnr(reference: np.ndarray, image: np.ndarray) -> float:
+    mse = np.mean((reference.astype(np.float64) - image.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255. ** 2 / mse))
+
+def ssim(reference: np.ndarray, image: np.ndarray) -> float:
+    """ Structural similarity on grayscale images with 11x11 gaussian window (Wang et al. 2004)
+    """
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    x = cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    y = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    blur = lambda a: cv2.GaussianBlur(a, (11, 11), 1.5)
+    mu_x, mu_y = blur(x), blur(y)
+    sigma_x = blur(x * x) - mu_x ** 2
+    sigma_y = blur(y * y) - mu_y ** 2
+    sigma_xy = blur(x * y) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (sigma_x + sigma_y + c2))
+    return float(ssim_map.mean())
+
+
+def _rss_mb() -> typing.Optional[float]:
+    """Current resident memory of this process, includes onnxruntime native arena and weights"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def evaluate(
+    model_path: str,
+    images: typing.List[np.ndarray],
+    reference_outputs: typing.Optional[typing.List[np.ndarray]] = None,
+    latency_size: typing.Tuple[int, int] = (512, 512),
+    runs: int = 10,
+    ) -> typing.Tuple[dict, typing.List[np.ndarray]]:
+    """ Measure latency, memory and output difference against fp32 reference outputs
+
+    Returns:
+        result: (dict) - latency_ms, load_ms, file_size_mb, rss_mb (resident memory added by session and runs,
+            None if it can't be read), peak_python_mb and psnr/ssim if reference is given
+        outputs: (typing.List[np.ndarray]) - model outputs for images
+    """
+    # tracemalloc sees only Python allocations, RSS delta also covers native weights and arena of onnxruntime
+    gc.collect()
+    rss_before = _rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+    load_ms = (time.perf_counter() - start) * 1000
+    input_name = session.get_inputs()[0].name
+
+    outputs = [denormalize(session.run(None, {input_name: normalize(image)})[0]) for image in images]
+
+    latency_input = normalize(cv2.resize(images[0], latency_size))
+    session.run(None, {input_name: latency_input})  # warm up
+    start = time.perf_counter()
+    for _ in range(runs):
+        session.run(None, {input_name: latency_input})
+    latency_ms = (time.perf_counter() - start) * 1000 / runs
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = _rss_mb()
+
+    result = {
+        "latency_ms": latency_ms,
+        "load_ms": load_ms,
+        "file_size_mb": os.path.getsize(model_path) / 1024 / 1024,
+        "rss_mb": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+        "peak_python_mb": peak / 1024 / 1024,
+    }
+    if reference_outputs is not None:
+        result["psnr"] = float(np.mean([min(psnr(r, o), 100.) for r, o in zip(reference_outputs, outputs)]))
+        result["ssim"] = float(np.mean([ssim(r, o) for r, o in zip(reference_outputs, outputs)]))
+
+    return result, outputs
+
+def evaluate_isolated(*args, **kwargs) -> typing.Tuple[dict, typing.List[np.ndarray]]:
+    """ Run evaluate in a fresh process, so rss_mb doesn't depend on onnxruntime initialization or memory
+    freed by previously evaluated variants of this process
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(evaluate, *args, **kwargs).result()
+
+
+def build_report(
+    model_paths: typing.Iterable[str],
+    precisions: typing.Iterable[str] = PRECISIONS[1:],
+    image_folders: typing.Iterable[str] = ("examples", "testing"),
+    ) -> dict:
+    """ Quantize every model to every precision and evaluate all variants against fp32
+
+    Returns:
+        report: (dict) - {model file name: {precision: evaluation result}}
+    """
+    images = load_images(image_folders)
+    if not images:
+        raise Exception(f"No images found in {image_folders}")
+    # Half of the images calibrate static quantization, the other half measures accuracy
+    calibration_images, evaluation_images = images[::2], images[1::2] or images
+
+    report = {}
+    for model_path in model_paths:
+        print(f"Evaluating {model_path}")
+        fp32, reference_outputs = evaluate_isolated(model_path, evaluation_images)
+        model_report = {"fp32": fp32}
+        for precision in precisions:
+            try:
+                output_path = quantize_model(model_path, precision, calibration_images)
+                model_report[precision], _ = evaluate_isolated(output_path, evaluation_images, reference_outputs)
+            except Exception as e:
+                print(f"Failed to create {precision} variant of {model_path}: {e}")
+                model_report[precision] = {"error": str(e)}
+            print(f"  {precision}: {model_report[precision]}")
+        report[os.path.basename(model_path)] = model_report
+
+    return report
+
+def _format_mb(value: typing.Optional[float]) -> str:
+    return f"{value:.1f}" if value is not None else "n/a"
+
+def write_report(report: dict, output_dir: str = "models") -> None:
+    """ Write report as json for AnimeGAN precision="auto" and as markdown table for people
+    """
+    with open(os.path.join(output_dir, QUANTIZATION_REPORT), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    lines = [
+        "| model | precision | latency ms | load ms | size MB | RSS MB | PSNR | SSIM |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for model_name, model_report in report.items():
+        for precision, result in model_report.items():
+            if "error" in result:
+                lines.append(f"| {model_name} | {precision} | failed: {result['error']} | | | | | |")
+                continue
+            lines.append(
+                f"| {model_name} | {precision} | {result['latency_ms']:.1f} | {result['load_ms']:.1f} | "
+                f"{result['file_size_mb']:.1f} | {_format_mb(result.get('rss_mb'))} | {result.get('psnr', float('inf')):.2f} | {result.get('ssim', 1.):.4f} |"
+            )
+    with open(os.path.join(output_dir, QUANTIZATION_REPORT.replace(".json", ".md")), 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create quantized AnimeGAN variants and accuracy vs latency report")
+    parser.add_argument("--models", nargs="+", default=[f"models/{name}.onnx" for name in ['Hayao_64', 'Hayao-60', 'Paprika_54', 'Shinkai_53']])
+    parser.add_argument("--precisions", nargs="+", default=list(PRECISIONS[1:]), choices=PRECISIONS[1:])
+    parser.add_argument("--images", nargs="+", default=["examples", "testing"])
+    args = parser.parse_args()
+
+    report = build_report(args.models, args.precisions, args.images)
+    write_report(report, os.path.dirname(args.models[0]) or ".")
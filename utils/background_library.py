@@ -0,0 +1,130 @@
+import cv2
+import stow
+import typing
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+class BackgroundLibrary:
+    """Lazily decoded, ordered collection of background images
+
+    Only file paths are listed up front. Images are decoded on first use, resized to the requested
+    frame size and kept in a bounded LRU, so memory holds cache_size backgrounds at frame resolution
+    instead of the whole folder at full resolution. Neighbours of the current index are decoded by a
+    background thread, so switching to the next or previous background is usually a cache hit.
+    """
+    def __init__(self, images_path: str, cache_size: int = 8, prefetch: int = 1) -> None:
+        """
+        Args:
+            images_path: (str) - path to folder with background images
+            cache_size: (int) - maximum number of decoded backgrounds kept in memory
+            prefetch: (int) - number of neighbours on each side of current index decoded ahead
+        """
+        self.paths = sorted(image.path for image in stow.ls(images_path) if isinstance(image, stow.File))
+        if not self.paths:
+            raise Exception(f"No background images found in {images_path}")
+
+        self.index = 0
+        self.cache_size = max(1, cache_size)
+        self.prefetch = prefetch
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="background-prefetch") if prefetch else None
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def _decode(self, index: int, size: typing.Optional[typing.Tuple[int, int]]) -> np.ndarray:
+        image = cv2.imread(self.paths[index])
+        if image is None:
+            raise Exception(f"Unable to read background image {self.paths[index]}")
+        if size is not None and image.shape[1::-1] != tuple(size):
+            image = cv2.resize(image, tuple(size), interpolation=cv2.INTER_AREA)
+        return image
+
+    def _load(self, key: typing.Tuple[int, typing.Optional[typing.Tuple[int, int]]]) -> np.ndarray:
+        """Decode image for key once, concurrent callers of the same key wait for the first one"""
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            image = self._decode(*key)
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._pending.pop(key, None)
+            self._cache[key] = image
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        future.set_result(image)
+        return image
+
+    def get(self, index: int, size: typing.Optional[typing.Tuple[int, int]] = None) -> np.ndarray:
+        """Background at index
+
+        Args:
+            index: (int) - index of background, wraps around
+            size: (typing.Tuple[int, int]) - (width, height) to resize to, None keeps original resolution
+
+        Returns:
+            image: (np.ndarray) - BGR background image, shared with cache and must not be modified
+        """
+        key = (index % len(self.paths), tuple(size) if size is not None else None)
+        image = self._load(key)
+        self._prefetch(key[0], key[1])
+        return image
+
+    def current(self, size: typing.Optional[typing.Tuple[int, int]] = None) -> np.ndarray:
+        """Background at current index, see get"""
+        return self.get(self.index, size)
+
+    def move(self, step: int = 1) -> int:
+        """Move current index by step, wrapping around, without decoding anything
+
+        Args:
+            step: (int) - number of backgrounds to move forward, negative moves backward
+
+        Returns:
+            index: (int) - new current index
+        """
+        self.index = (self.index + step) % len(self.paths)
+        return self.index
+
+    def _prefetch(self, index: int, size: typing.Optional[typing.Tuple[int, int]]) -> None:
+        if self._executor is None or len(self.paths) < 2:
+            return
+        for offset in range(1, self.prefetch + 1):
+            for neighbour in ((index + offset) % len(self.paths), (index - offset) % len(self.paths)):
+                key = (neighbour, size)
+                with self._lock:
+                    if key in self._cache or key in self._pending:
+                        continue
+                self._executor.submit(self._load_quietly, key)
+
+    def _load_quietly(self, key) -> None:
+        try:
+            self._load(key)
+        except Exception:
+            # Unreadable file is reported when it is actually requested
+            pass
+
+    def close(self) -> None:
+        """Stop prefetch thread"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
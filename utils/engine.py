@@ -1,10 +1,160 @@
+import os
 import cv2
+import time
 import stow
+import queue
+import shutil
+import hashlib
+import itertools
 import typing
+import tempfile
+import threading
+import subprocess
+import multiprocessing
 import numpy as np
 from tqdm import tqdm 
 
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
 from utils.selfieSegmentation import MPSegmentation
+from utils.mask_store import MaskStore
+from utils.profiler import PipelineProfiler
+from utils.streaming import LatestFrameCapture, Sink, drain
+
+def concat_videos(segment_paths: typing.List[str], output_path: str, fps: int, size: typing.Tuple[int, int]) -> None:
+    """Concatenate video segments into one video
+    Segments are joined with ffmpeg stream copy when ffmpeg is installed (no re-encoding),
+    otherwise they are decoded and written again with OpenCV
+
+    Args:
+        segment_paths: (typing.List[str]) - ordered paths to video segments
+        output_path: (str) - path to write concatenated video to
+        fps: (int) - frames per second, used only by OpenCV fallback
+        size: (typing.Tuple[int, int]) - (width, height) of frames, used only by OpenCV fallback
+    """
+    if shutil.which("ffmpeg"):
+        list_path = f"{output_path}.segments.txt"
+        with open(list_path, "w") as f:
+            for segment_path in segment_paths:
+                escaped = os.path.abspath(segment_path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        try:
+            subprocess.run(
+                ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_path],
+                check=True,
+            )
+            return
+        except subprocess.CalledProcessError:
+            pass
+        finally:
+            os.remove(list_path)
+
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'MP4V'), fps, size)
+    for segment_path in segment_paths:
+        cap = cv2.VideoCapture(segment_path)
+        while True:
+            success, frame = cap.read()
+            if not success:
+                break
+            out.write(frame)
+        cap.release()
+    out.release()
+
+# ffmpeg encoders producing streams that can be concatenated with stream copied source of given codec
+PASSTHROUGH_ENCODERS = {"h264": "libx264", "hevc": "libx265", "mpeg4": "mpeg4", "vp9": "libvpx-vp9", "mjpeg": "mjpeg"}
+
+def probe_video(video_path: str) -> typing.Optional[dict]:
+    """Read codec, frame rate and key frame indices of the first video stream with ffprobe
+    Only packet headers are read, nothing is decoded
+
+    Returns:
+        info: (dict) - codec, pix_fmt, frame_rate (as ffmpeg rational string) and sorted keyframes indices,
+            None if ffprobe isn't installed or fails
+    """
+    if not shutil.which("ffprobe"):
+        return None
+    try:
+        stream = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=codec_name,pix_fmt,r_frame_rate",
+             "-of", "csv=p=0", video_path],
+            check=True, capture_output=True, text=True,
+        ).stdout.strip().split(",")
+        packets = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts,flags", "-of", "csv=p=0", video_path],
+            check=True, capture_output=True, text=True,
+        ).stdout.split()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+    codec, pix_fmt, frame_rate = stream[:3]
+    # Packets are in decode order, frame index is the rank of packet pts in presentation order
+    pts = []
+    for line in packets:
+        value, flags = (line.split(",") + [""])[:2]
+        if value.lstrip("-").isdigit():
+            pts.append((int(value), "K" in flags))
+    order = sorted(pts)
+    keyframes = [index for index, (_, key) in enumerate(order) if key]
+
+    return {"codec": codec, "pix_fmt": pix_fmt, "frame_rate": frame_rate, "keyframes": keyframes}
+
+def cut_video_copy(video_path: str, output_path: str, start_time: float = 0.0, frames: typing.Optional[int] = None) -> None:
+    """Copy part of video stream without re-encoding, start_time must be on a key frame"""
+    command = ["ffmpeg", "-y", "-loglevel", "error"]
+    if start_time:
+        command += ["-ss", f"{start_time:.6f}"]
+    command += ["-i", video_path, "-map", "0:v:0", "-an", "-c", "copy"]
+    if start_time:
+        # Copied key frame lies before start_time, shift it to zero instead of a negative timestamp
+        command += ["-avoid_negative_ts", "make_zero"]
+    if frames is not None:
+        command += ["-frames:v", str(frames)]
+    subprocess.run(command + [output_path], check=True)
+
+def _process_video_chunk(
+    engine_kwargs: dict,
+    custom_objects_factory: typing.Callable,
+    start: int,
+    end: int,
+    segment_path: str,
+    source_key: typing.Optional[str] = None,
+    ) -> int:
+    """Worker process function for Engine.process_video_parallel, processes frames [start, end) into segment_path
+
+    Returns:
+        frames: (int) - number of written frames
+    """
+    custom_objects = custom_objects_factory() if custom_objects_factory else []
+    if not isinstance(custom_objects, (list, tuple)):
+        custom_objects = [custom_objects]
+    engine = Engine(**engine_kwargs, custom_objects=custom_objects)
+    engine.set_segmentation_source(engine.video_path, max(start, engine.start_video_frame), source_key)
+
+    cap = cv2.VideoCapture(engine.video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    out = cv2.VideoWriter(segment_path, cv2.VideoWriter_fourcc(*'MP4V'), fps, (width, height))
+
+    written = 0
+    try:
+        for fnum in range(start, end):
+            success, frame = cap.read()
+            if not success:
+                break
+            if not engine.check_video_frames_range(fnum):
+                frame = engine.custom_processing(engine.flip(frame))
+            out.write(frame)
+            written += 1
+    finally:
+        # Mask store must not attribute later frames of this worker to the video
+        engine.set_segmentation_source(None)
+        cap.release()
+        out.release()
+
+    return written
 
 class Engine:
     """Object to process webcam stream, video source or images
@@ -22,6 +172,13 @@ class Engine:
         start_video_frame: int = 0,
         end_video_frame: int = 0,
         break_on_end: bool = False,
+        pipelined: bool = False,
+        queue_size: int = 8,
+        workers: int = 1,
+        custom_objects_factory: typing.Optional[typing.Callable] = None,
+        target_fps: float = 0,
+        max_read_failures: int = 30,
+        profiler: typing.Optional[PipelineProfiler] = None,
         ) -> None:
         """Initialize Engine object for further processing
 
@@ -35,6 +192,15 @@ class Engine:
             output_extension: (str) - additional text to add to processed image or video when saving output
             start_video_frame: (int) - video frame from which to start applying custom_objects to video
             end_video_frame: (int) - last video frame to which apply custom_objects to video
+            break_on_end: (bool) - stop writing video after end_video_frame
+            pipelined: (bool) - decode, process and encode video in overlapping stages joined by bounded queues
+            queue_size: (int) - maximum number of frames waiting between pipeline stages
+            workers: (int) - number of processes to split video frames between, 0 uses all cores
+            custom_objects_factory: (typing.Callable) - picklable callable creating custom objects in every worker
+                process, e.g. functools.partial(AnimeGAN, "models/Hayao_64.onnx"), required when workers != 1
+            target_fps: (float) - if set, webcam runs in real-time mode adapting processing resolution to hold this fps
+            max_read_failures: (int) - stop webcam processing after this many consecutive failed reads
+            profiler: (PipelineProfiler) - if set, records latency of every custom object, flip, decode and encode
         """
         self.video_path = video_path
         self.image_path = image_path
@@ -46,6 +212,16 @@ class Engine:
         self.start_video_frame = start_video_frame
         self.end_video_frame = end_video_frame
         self.break_on_end = break_on_end
+        self.pipelined = pipelined
+        self.queue_size = queue_size
+        self.pipeline_stats = {}
+        self.workers = workers
+        self.custom_objects_factory = custom_objects_factory
+        self.target_fps = target_fps
+        self.max_read_failures = max_read_failures
+        self.realtime_stats = {}
+        self.profiler = profiler
+        self._stage_names = None
 
     def flip(self, frame: np.ndarray) -> np.ndarray:
         """Flip given frame horizontally
@@ -56,10 +232,53 @@ class Engine:
             frame: (np.ndarray) - fliped frame if self.flip_view = True
         """
         if self.flip_view:
-            return cv2.flip(frame, 1)
+            with self.measure("flip"):
+                return cv2.flip(frame, 1)
 
         return frame
 
+    def measure(self, stage: str):
+        """Context manager timing stage with profiler, does nothing without profiler"""
+        return self.profiler.measure(stage) if self.profiler is not None else nullcontext()
+
+    def stage_names(self) -> typing.List[str]:
+        """Profiler stage name of every custom object, class name suffixed with index when it repeats"""
+        if self._stage_names is None or len(self._stage_names) != len(self.custom_objects):
+            names = [type(custom_object).__name__ for custom_object in self.custom_objects]
+            self._stage_names = [f"{name}_{i}" if names.count(name) > 1 else name for i, name in enumerate(names)]
+        return self._stage_names
+
+    def set_segmentation_source(
+        self,
+        source: typing.Union[str, np.ndarray, None],
+        frame_index: int = 0,
+        source_key: typing.Optional[str] = None,
+        ) -> typing.Optional[str]:
+        """Tell MPSegmentation custom objects which video or image following frames come from, so masks
+        stored in their mask_store are reused when the same source is rendered again with another background
+
+        Args:
+            source: (typing.Union[str, np.ndarray]) - path or image buffer of source, None for sources without identity
+            frame_index: (int) - index of next processed frame within source
+            source_key: (str) - already computed key of source, skips hashing source
+
+        Returns:
+            source_key: (str) - key of source, None if no custom object has mask_store
+        """
+        segmentations = [custom_object for custom_object in self.custom_objects if isinstance(custom_object, MPSegmentation)]
+        if source_key is None and source is not None and any(segmentation.mask_store is not None for segmentation in segmentations):
+            if isinstance(source, str):
+                source_key = MaskStore.file_key(source)
+            else:
+                source_key = MaskStore.make_key(str(source.shape), content=hashlib.sha256(np.ascontiguousarray(source)).hexdigest())
+            if self.flip_view:
+                source_key = MaskStore.make_key(source_key, flip_view=True)
+
+        for segmentation in segmentations:
+            segmentation.set_source(source_key, frame_index)
+
+        return source_key
+
     def custom_processing(self, frame: np.ndarray) -> np.ndarray:
         """Process frame with custom objects (custom object must have call function for each iteration)
         Args:
@@ -68,6 +287,13 @@ class Engine:
         Returns:
             frame: (np.ndarray) - custom processed frame
         """
+        if self.profiler is not None:
+            for custom_object, stage in zip(self.custom_objects, self.stage_names()):
+                with self.profiler.measure(stage):
+                    frame = custom_object(frame)
+            self.profiler.frame()
+            return frame
+
         if self.custom_objects:
             for custom_object in self.custom_objects:
                 frame = custom_object(frame)
@@ -127,7 +353,10 @@ class Engine:
                 extension = stow.extension(image)
                 if output_path is None:
                     output_path = image.replace(f".{extension}", f"_{self.output_extension}.{extension}")
+                self.set_segmentation_source(image)
                 image = cv2.imread(image)
+        else:
+            self.set_segmentation_source(image)
 
         image = self.custom_processing(self.flip(image))
 
@@ -142,11 +371,17 @@ class Engine:
         """
         # Create a VideoCapture object for given webcam_id
         cap = cv2.VideoCapture(self.webcam_id)
+        failures = 0
         while cap.isOpened():  
             success, frame = cap.read()
             if not success or frame is None:
+                failures += 1
+                if failures >= self.max_read_failures:
+                    print(f"Stopping after {failures} empty camera frames.")
+                    break
                 print("Ignoring empty camera frame.")
                 continue
+            failures = 0
 
             if return_frame:
                 break
@@ -162,6 +397,82 @@ class Engine:
         cap.release()
         return frame
 
+    def _scalable_objects(self) -> typing.List[typing.Tuple[object, str, float]]:
+        """Custom objects whose processing resolution can be changed: AnimeGAN downsize_ratio and
+        MPSegmentation input_scale, also when wrapped (e.g. by TemporalReuse)
+
+        Returns:
+            (typing.List) - (object, attribute name, initial value) for every scalable object
+        """
+        scalable = []
+        for custom_object in self.custom_objects:
+            custom_object = getattr(custom_object, "custom_object", custom_object)
+            for attribute in ("downsize_ratio", "input_scale"):
+                if hasattr(custom_object, attribute):
+                    scalable.append((custom_object, attribute, getattr(custom_object, attribute)))
+        return scalable
+
+    def process_webcam_realtime(self, target_fps: typing.Optional[float] = None, min_scale: float = 0.25) -> dict:
+        """Process webcam in real time: a capture thread always hands over the newest frame and drops stale ones,
+        and processing resolution of AnimeGAN and MPSegmentation is adjusted on the fly to hold target_fps
+
+        Args:
+            target_fps: (float) - frames per second to hold, defaults to self.target_fps
+            min_scale: (float) - lowest fraction of initial processing resolution to go down to
+
+        Returns:
+            realtime_stats: (dict) - achieved fps, mean and last end-to-end latency in ms, dropped frames and current scale
+        """
+        target_fps = target_fps or self.target_fps or 30
+        scalable = self._scalable_objects()
+        scale = 1.0
+        capture = LatestFrameCapture(self.webcam_id, self.max_read_failures)
+
+        frames, latency_total, start = 0, 0.0, time.perf_counter()
+        frame_time = 1 / target_fps
+        try:
+            while True:
+                frame, captured_at = capture.read()
+                if frame is None:
+                    break
+
+                began = time.perf_counter()
+                frame = self.custom_processing(self.flip(frame))
+                finished = time.perf_counter()
+
+                # Exponential average of processing time drives resolution, with a dead band against oscillation
+                frame_time = 0.8 * frame_time + 0.2 * (finished - began)
+                new_scale = scale
+                if frame_time > 1.1 / target_fps:
+                    new_scale = max(min_scale, scale * 0.9)
+                elif frame_time < 0.7 / target_fps:
+                    new_scale = min(1.0, scale * 1.05)
+                if new_scale != scale:
+                    scale = new_scale
+                    for custom_object, attribute, initial in scalable:
+                        setattr(custom_object, attribute, initial * scale)
+
+                frames += 1
+                latency = finished - captured_at
+                latency_total += latency
+                elapsed = finished - start
+                self.realtime_stats = {
+                    "fps": frames / elapsed if elapsed else 0.0,
+                    "latency_ms": latency * 1000,
+                    "mean_latency_ms": latency_total / frames * 1000,
+                    "dropped": capture.dropped,
+                    "scale": scale,
+                }
+
+                if not self.display(frame, webcam=True):
+                    break
+        finally:
+            capture.release()
+            for custom_object, attribute, initial in scalable:
+                setattr(custom_object, attribute, initial)
+
+        return self.realtime_stats
+
     def check_video_frames_range(self, fnum):
         """Not to waste resources this function processes only specified range of video frames
 
@@ -185,45 +496,350 @@ class Engine:
         if not stow.exists(self.video_path):
             raise Exception(f"Given video path doesn't exists {self.video_path}")
 
-        # Create a VideoCapture object and read from input file
-        cap = cv2.VideoCapture(self.video_path)
+        # Frames are processed contiguously from start_video_frame, also resets state carried between frames
+        source_key = self.set_segmentation_source(self.video_path, self.start_video_frame)
 
-        # Check if camera opened successfully
-        if not cap.isOpened():
-            raise Exception(f"Error opening video stream or file {self.video_path}")
+        try:
+            # Create a VideoCapture object and read from input file
+            cap = cv2.VideoCapture(self.video_path)
 
-        # Capture video details
-        width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            # Check if camera opened successfully
+            if not cap.isOpened():
+                raise Exception(f"Error opening video stream or file {self.video_path}")
 
-        # Create video writer in the same location as original video
-        output_path = self.video_path.replace(f".{stow.extension(self.video_path)}", f"_{self.output_extension}.mp4")
-        out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'MP4V'), fps, (width, height))
+            # Capture video details
+            width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = int(cap.get(cv2.CAP_PROP_FPS))
+            frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
-        # Read all frames from video
-        for fnum in tqdm(range(frames)):
-            # Capture frame-by-frame
-            success, frame = cap.read()
-            if not success:
-                break
+            # Create video writer in the same location as original video
+            output_path = self.video_path.replace(f".{stow.extension(self.video_path)}", f"_{self.output_extension}.mp4")
 
-            if self.check_video_frames_range(fnum):
-                out.write(frame)
-                if self.break_on_end and fnum >= self.end_video_frame:
+            # Chunks are split by frame count, streams that don't report one are processed serially
+            if self.workers != 1 and frames > 0:
+                cap.release()
+                self.process_video_parallel(output_path, frames, fps, (width, height), source_key)
+                return
+
+            if (self.start_video_frame or self.end_video_frame) and frames > 0 and self.process_video_range(cap, output_path, frames, (width, height)):
+                return
+
+            out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'MP4V'), fps, (width, height))
+
+            if self.pipelined:
+                self.process_video_pipelined(cap, out, frames)
+                return
+
+            # Read all frames from video, until the capture ends when frame count is unknown
+            for fnum in tqdm(range(frames) if frames > 0 else itertools.count(), total=frames or None):
+                # Capture frame-by-frame
+                with self.measure("decode"):
+                    success, frame = cap.read()
+                if not success:
+                    break
+
+                if self.check_video_frames_range(fnum):
+                    with self.measure("encode"):
+                        out.write(frame)
+                    if self.break_on_end and fnum >= self.end_video_frame:
+                        break
+                    continue
+
+                frame = self.custom_processing(self.flip(frame))
+
+                with self.measure("encode"):
+                    out.write(frame)
+
+                if not self.display(frame):
                     break
+
+            cap.release()
+            out.release()
+        finally:
+            # Masks of frames processed after this video must not be stored under its key
+            self.set_segmentation_source(None)
+
+    def process_video_range(
+        self,
+        cap: cv2.VideoCapture,
+        output_path: str,
+        frames: int,
+        size: typing.Tuple[int, int],
+        ) -> bool:
+        """Process only start_video_frame..end_video_frame, copy the rest of the video without decoding it.
+        The processed part is widened to the surrounding key frames, because stream copy can only cut there.
+        Frames of that part outside the range are decoded and re-encoded unchanged, everything before and
+        after is stream copied and all parts are concatenated with ffmpeg
+
+        Args:
+            cap: (cv2.VideoCapture) - opened video
+            output_path: (str) - path to write processed video to
+            frames: (int) - number of frames in video
+            size: (typing.Tuple[int, int]) - (width, height) of frames
+
+        Returns:
+            (bool) - False if pass-through isn't possible (no ffmpeg/ffprobe or unsupported codec) and nothing was done
+        """
+        info = probe_video(self.video_path)
+        if info is None or info["codec"] not in PASSTHROUGH_ENCODERS or not info["keyframes"] or not shutil.which("ffmpeg"):
+            return False
+
+        first = min(self.start_video_frame, frames - 1)
+        last = min(self.end_video_frame or frames - 1, frames - 1)
+        keyframes = info["keyframes"]
+        segment_start = max([k for k in keyframes if k <= first] or [0])
+        segment_end = frames if self.break_on_end else min([k for k in keyframes if k > last] or [frames])
+        numerator, denominator = (info["frame_rate"].split("/") + ["1"])[:2]
+        fps = float(numerator) / float(denominator)
+
+        segment_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_path)))
+        try:
+            segment_paths = []
+            if segment_start > 0:
+                segment_paths.append(os.path.join(segment_dir, "head.mp4"))
+                cut_video_copy(self.video_path, segment_paths[-1], frames=segment_start)
+
+            # Encode processed part with the source codec so the parts can be joined by stream copy. Without B-frames
+            # the part has no decode delay, which would otherwise shift its timestamps against the copied parts
+            segment_paths.append(os.path.join(segment_dir, "range.mp4"))
+            encoder = subprocess.Popen(
+                ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{size[0]}x{size[1]}",
+                 "-r", info["frame_rate"], "-i", "-", "-c:v", PASSTHROUGH_ENCODERS[info["codec"]], "-bf", "0",
+                 "-pix_fmt", info["pix_fmt"], segment_paths[-1]],
+                stdin=subprocess.PIPE,
+            )
+            cap.set(cv2.CAP_PROP_POS_FRAMES, segment_start)
+            try:
+                for fnum in tqdm(range(segment_start, min(segment_end, last + 1) if self.break_on_end else segment_end)):
+                    success, frame = cap.read()
+                    if not success:
+                        break
+                    if not self.check_video_frames_range(fnum):
+                        frame = self.custom_processing(self.flip(frame))
+                        if not self.display(frame):
+                            break
+                    encoder.stdin.write(np.ascontiguousarray(frame).tobytes())
+            finally:
+                encoder.stdin.close()
+                encoder.wait()
+                cap.release()
+            if encoder.returncode:
+                raise Exception(f"ffmpeg failed to encode processed range of {self.video_path}")
+
+            if segment_end < frames and not self.break_on_end:
+                segment_paths.append(os.path.join(segment_dir, "tail.mp4"))
+                # Half a frame past the key frame, input seeking picks the last key frame before the timestamp
+                cut_video_copy(self.video_path, segment_paths[-1], start_time=(segment_end + 0.5) / fps)
+
+            concat_videos(segment_paths, output_path, int(fps), size)
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+        return True
+
+    def _put(self, q: queue.Queue, item, stop: threading.Event) -> bool:
+        """Blocking put that gives up when pipeline is stopped, returns False if item wasn't queued"""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
                 continue
+        return False
 
-            frame = self.custom_processing(self.flip(frame))
+    def process_video_pipelined(self, cap: cv2.VideoCapture, out: cv2.VideoWriter, frames: int) -> dict:
+        """Process video with decoding and encoding on their own threads, overlapping with custom processing.
+        Stages are joined by bounded queues, so a slow stage holds back the others instead of buffering
+        the whole video. Frame order is kept because every stage handles frames first in first out.
 
-            out.write(frame)
+        Args:
+            cap: (cv2.VideoCapture) - opened video to read frames from
+            out: (cv2.VideoWriter) - opened writer to write processed frames to
+            frames: (int) - number of frames in video
 
-            if not self.display(frame):
-                break
+        Returns:
+            pipeline_stats: (dict) - frames, busy seconds and frames per busy second for each stage
+        """
+        decoded = queue.Queue(maxsize=self.queue_size)
+        processed = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors = []
+        stats = {stage: {"frames": 0, "busy_s": 0.0} for stage in ("decode", "process", "encode")}
+
+        def reader():
+            try:
+                for fnum in range(frames) if frames > 0 else itertools.count():
+                    start = time.perf_counter()
+                    success, frame = cap.read()
+                    stats["decode"]["busy_s"] += time.perf_counter() - start
+                    if self.profiler is not None:
+                        self.profiler.observe("decode", time.perf_counter() - start)
+                    if not success:
+                        break
+                    stats["decode"]["frames"] += 1
+                    skip = self.check_video_frames_range(fnum)
+                    if not self._put(decoded, (fnum, frame, skip), stop):
+                        return
+                    if skip and self.break_on_end and fnum >= self.end_video_frame:
+                        break
+            except Exception as e:
+                errors.append(e)
+            finally:
+                self._put(decoded, None, stop)
+
+        def writer():
+            try:
+                while True:
+                    frame = processed.get()
+                    if frame is None:
+                        break
+                    start = time.perf_counter()
+                    out.write(frame)
+                    stats["encode"]["busy_s"] += time.perf_counter() - start
+                    if self.profiler is not None:
+                        self.profiler.observe("encode", time.perf_counter() - start)
+                    stats["encode"]["frames"] += 1
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+        threads = [threading.Thread(target=reader, daemon=True), threading.Thread(target=writer, daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        wall_start = time.perf_counter()
+        progress = tqdm(total=frames or None)
+        try:
+            # Processing stays on the calling thread, custom objects and cv2.imshow expect that
+            while not stop.is_set():
+                try:
+                    item = decoded.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
 
-        cap.release()
-        out.release()
+                fnum, frame, skip = item
+                if not skip:
+                    start = time.perf_counter()
+                    frame = self.custom_processing(self.flip(frame))
+                    stats["process"]["busy_s"] += time.perf_counter() - start
+                    stats["process"]["frames"] += 1
+
+                if not self._put(processed, frame, stop):
+                    break
+                progress.update()
+
+                if not skip and not self.display(frame):
+                    break
+        finally:
+            progress.close()
+            stop.set()
+            # Writer drains already processed frames before it sees the end marker
+            while threads[1].is_alive():
+                try:
+                    processed.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            for thread in threads:
+                thread.join()
+            cap.release()
+            out.release()
+            self.set_segmentation_source(None)
+
+        if errors:
+            raise errors[0]
+
+        wall = time.perf_counter() - wall_start
+        for stage in stats.values():
+            stage["fps"] = stage["frames"] / stage["busy_s"] if stage["busy_s"] else 0.0
+        stats["wall_s"] = wall
+        stats["fps"] = stats["encode"]["frames"] / wall if wall else 0.0
+        self.pipeline_stats = stats
+
+        return stats
+
+    def process_video_parallel(
+        self,
+        output_path: str,
+        frames: int,
+        fps: int,
+        size: typing.Tuple[int, int],
+        source_key: typing.Optional[str] = None,
+        ) -> None:
+        """Split video frames into contiguous chunks processed by worker processes and concatenate the segments.
+        Every worker creates its own custom objects with custom_objects_factory, so heavy models like AnimeGAN
+        or MPSegmentation are never shared between processes
+
+        Args:
+            output_path: (str) - path to write processed video to
+            frames: (int) - number of frames in video
+            fps: (int) - frames per second of video
+            size: (typing.Tuple[int, int]) - (width, height) of frames
+            source_key: (str) - MaskStore key of video passed to workers, so they don't hash video again
+        """
+        if self.custom_objects_factory is None and self.custom_objects:
+            raise Exception("custom_objects_factory is required to process video in several processes")
+
+        if self.break_on_end and self.end_video_frame:
+            frames = min(frames, self.end_video_frame + 1)
+
+        if frames < 1:
+            raise Exception(f"Unknown frame count of {self.video_path}, it can only be processed with workers=1")
+
+        workers = min(self.workers or os.cpu_count() or 1, frames)
+        chunk = -(-frames // workers)
+        engine_kwargs = {
+            "video_path": self.video_path,
+            "flip_view": self.flip_view,
+            "start_video_frame": self.start_video_frame,
+            "end_video_frame": self.end_video_frame,
+        }
+
+        segment_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_path)))
+        try:
+            segment_paths = [os.path.join(segment_dir, f"segment_{i:04d}.mp4") for i in range(workers)]
+            # Spawned workers don't inherit onnxruntime or mediapipe threads of this process
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [
+                    executor.submit(
+                        _process_video_chunk, engine_kwargs, self.custom_objects_factory,
+                        i * chunk, min((i + 1) * chunk, frames), segment_path, source_key,
+                    )
+                    for i, segment_path in enumerate(segment_paths)
+                ]
+                with tqdm(total=frames) as progress:
+                    for future in futures:
+                        progress.update(future.result())
+
+            concat_videos(segment_paths, output_path, fps, size)
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+    def stream(self, source: typing.Iterable[np.ndarray]) -> typing.Iterator[np.ndarray]:
+        """Lazily process frames of any source, e.g. utils.streaming video_source, webcam_source,
+        array_source or image_source, nothing is collected in memory
+
+        Args:
+            source: (typing.Iterable[np.ndarray]) - frames to process
+
+        Returns:
+            frames: (typing.Iterator[np.ndarray]) - processed frames in source order
+        """
+        # Frames of arbitrary source can't be matched with stored masks
+        self.set_segmentation_source(None)
+        for frame in source:
+            yield self.custom_processing(self.flip(frame))
+
+    def run_stream(self, source: typing.Iterable[np.ndarray], *sinks: Sink) -> int:
+        """Process frames of source and write them to all sinks, sinks are closed at the end
+
+        Returns:
+            frames: (int) - number of processed frames
+        """
+        return drain(self.stream(source), *sinks)
 
     def run(self):
         """Main object function to start processing image, video or webcam input
@@ -232,5 +848,7 @@ class Engine:
             self.process_video()
         elif self.image_path:
             self.process_image(self.image_path)
+        elif self.target_fps:
+            self.process_webcam_realtime()
         else:
             self.process_webcam()
\ No newline at end of file
@@ -0,0 +1,94 @@
+import os
+import cv2
+import typing
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+from utils.result_cache import ResultCache
+
+class MaskStore:
+    """Store of segmentation masks keyed by source content and frame index
+
+    Masks are quantized to 8 bits and kept as PNG, either in memory or in a ResultCache on disk (shared
+    between processes), both bounded by max_size_mb with least-recently-used masks evicted, so re-rendering the same video
+    or image with another background, colour or blur skips segmentation entirely.
+    """
+    def __init__(
+        self,
+        cache_dir: typing.Optional[str] = os.path.join('data', 'mask_store'),
+        max_size_mb: float = 1024,
+        compression: int = 1,
+        ) -> None:
+        """
+        Args:
+            cache_dir: (str) - directory to store masks in, None keeps them in memory of this process
+            max_size_mb: (float) - budget of stored masks on disk or in memory, least recently used are removed first
+            compression: (int) - PNG compression level 0..9, masks compress well already at low levels
+        """
+        self.cache = ResultCache(cache_dir, max_size_mb) if cache_dir else None
+        self.compression = compression
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def file_key(path: str, chunk_size: int = 1 << 20) -> str:
+        """Hash of file content, stays the same when file is moved or renamed"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(source_key: str, **params) -> str:
+        """Key of masks for source and segmentation parameters that influence masks"""
+        return ResultCache.make_key(source_key.encode(), **params)
+
+    @staticmethod
+    def _name(index: int) -> str:
+        return f"mask_{index:06d}.png"
+
+    def get(self, key: str, index: int) -> typing.Optional[np.ndarray]:
+        """Stored mask of frame index
+
+        Returns:
+            mask: (np.ndarray) - float32 foreground probability, None if mask isn't stored
+        """
+        if self.cache is not None:
+            data = self.cache.get(key, self._name(index))
+        else:
+            data = self._memory.get((key, index))
+            if data is not None:
+                self._memory.move_to_end((key, index))
+
+        if data is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        mask = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        return mask.astype(np.float32) * (1 / 255.)
+
+    def put(self, key: str, index: int, mask: np.ndarray) -> None:
+        """Store mask of frame index, mask should already be quantized with quantize"""
+        success, buffer = cv2.imencode('.png', cv2.convertScaleAbs(mask, alpha=255), [cv2.IMWRITE_PNG_COMPRESSION, self.compression])
+        if not success:
+            raise Exception("Unable to encode segmentation mask")
+
+        if self.cache is not None:
+            self.cache.put(key, self._name(index), buffer.tobytes())
+        else:
+            data = buffer.tobytes()
+            previous = self._memory.pop((key, index), None)
+            self._memory_size += len(data) - (len(previous) if previous is not None else 0)
+            self._memory[(key, index)] = data
+            while self._memory_size > self.max_size and self._memory:
+                self._memory_size -= len(self._memory.popitem(last=False)[1])
+
+    @staticmethod
+    def quantize(mask: np.ndarray) -> np.ndarray:
+        """Round mask to the 8 bit values it is stored with, so first and later renders composite alike"""
+        return cv2.convertScaleAbs(mask, alpha=255).astype(np.float32) * (1 / 255.)
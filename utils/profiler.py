@@ -0,0 +1,210 @@
+import io
+import sys
+import json
+import time
+import typing
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Upper bounds of latency histogram buckets in milliseconds
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+class LatencyHistogram:
+    """Fixed bucket latency histogram, cheap enough to observe every frame"""
+    def __init__(self, buckets_ms: typing.Sequence[float] = DEFAULT_BUCKETS_MS) -> None:
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * len(self.buckets_ms)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        milliseconds = seconds * 1000
+        for i, bound in enumerate(self.buckets_ms):
+            if milliseconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound in milliseconds of the bucket holding the q-th (0..100) percentile"""
+        if not self.count:
+            return 0.0
+        rank, seen = q / 100 * self.count, 0
+        for bound, count in zip(self.buckets_ms, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max * 1000)
+        return self.max * 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "min_ms": self.min * 1000 if self.count else 0.0,
+            "max_ms": self.max * 1000,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets_ms, self.counts)},
+        }
+
+
+class PipelineProfiler:
+    """Opt-in per stage latency histograms, frame count and peak memory for Engine
+    Pass it as Engine(profiler=PipelineProfiler()), stages are custom objects by class name,
+    flip, decode and encode
+    """
+    def __init__(self, track_memory: bool = False, buckets_ms: typing.Sequence[float] = DEFAULT_BUCKETS_MS) -> None:
+        """
+        Args:
+            track_memory: (bool) - trace Python allocations with tracemalloc to report peak, adds overhead
+            buckets_ms: (typing.Sequence[float]) - upper bounds of histogram buckets in milliseconds
+        """
+        self.buckets_ms = buckets_ms
+        self.stages = {}
+        self.frames = 0
+        self.started = time.perf_counter()
+        self.track_memory = track_memory
+        self._lock = threading.Lock()
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = LatencyHistogram(self.buckets_ms)
+            self.stages[stage].observe(seconds)
+
+    def frame(self) -> None:
+        with self._lock:
+            self.frames += 1
+
+    def memory(self) -> dict:
+        memory = {}
+        try:
+            # POSIX only, ru_maxrss is in bytes on macOS and in kilobytes on Linux
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            memory["peak_rss_mb"] = max_rss / 1024 / 1024 if sys.platform == "darwin" else max_rss / 1024
+        except ImportError:
+            try:
+                import psutil
+                # Windows reports peak working set, other platforms have resource
+                memory_info = psutil.Process().memory_info()
+                memory["peak_rss_mb"] = getattr(memory_info, "peak_wset", memory_info.rss) / 1024 / 1024
+            except ImportError:
+                pass
+        if self.track_memory and tracemalloc.is_tracing():
+            memory["peak_python_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        return memory
+
+    def to_dict(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "elapsed_s": elapsed,
+                "fps": self.frames / elapsed if elapsed else 0.0,
+                "stages": {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+                "memory": self.memory(),
+            }
+
+    def to_json(self, output_path: typing.Optional[str] = None) -> str:
+        text = json.dumps(self.to_dict(), indent=2)
+        if output_path:
+            with open(output_path, "w") as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self, prefix: str = "engine") -> str:
+        """Prometheus text exposition format, stage latency as histogram in seconds"""
+        lines = [
+            f"# HELP {prefix}_frames_total Processed frames",
+            f"# TYPE {prefix}_frames_total counter",
+            f"{prefix}_frames_total {self.frames}",
+            f"# HELP {prefix}_stage_seconds Latency of pipeline stages",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in self.stages.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets_ms, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound / 1000)
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                if histogram.buckets_ms[-1] != float("inf"):
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        memory = self.memory()
+        if "peak_rss_mb" in memory:
+            lines.append(f"# TYPE {prefix}_peak_rss_bytes gauge")
+            lines.append(f"{prefix}_peak_rss_bytes {int(memory['peak_rss_mb'] * 1024 * 1024)}")
+        return "\n".join(lines) + "\n"
+
+
+def profile_run(
+    function: typing.Callable,
+    *args,
+    backend: str = "cprofile",
+    output_path: typing.Optional[str] = None,
+    **kwargs,
+    ) -> typing.Tuple[typing.Any, str]:
+    """Run function once under a profiler, e.g. profile_run(engine.process_video)
+
+    Args:
+        function: (typing.Callable) - function to profile
+        backend: (str) - "cprofile" or "pyinstrument" (optional package)
+        output_path: (str) - write report there, .html for pyinstrument renders html report
+
+    Returns:
+        (result, report) - function result and text report
+    """
+    if backend == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise Exception("pyinstrument backend requires pyinstrument package")
+        profiler = Profiler()
+        profiler.start()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            profiler.stop()
+        report = profiler.output_text()
+        if output_path:
+            with open(output_path, "w") as f:
+                f.write(profiler.output_html() if output_path.endswith(".html") else report)
+        return result, report
+
+    if backend != "cprofile":
+        raise Exception(f"Unknown profiler backend {backend}")
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        profiler.disable()
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(40)
+    if output_path:
+        profiler.dump_stats(output_path)
+    return result, stream.getvalue()
@@ -0,0 +1,119 @@
+import io
+import os
+import json
+import time
+import uuid
+import sqlite3
+import typing
+import hashlib
+from PIL import Image
+
+class ResultCache:
+    """Content-addressed disk cache for results of the upload pipeline
+
+    Entries are keyed by a hash of the uploaded bytes plus pipeline parameters, each entry holds
+    named blobs (caption, sketch, stylized images, animations). Blobs are files written atomically,
+    a sqlite index tracks their size and last access so several server processes can share the
+    cache and least-recently-used entries are evicted when max_size_mb is exceeded.
+    """
+    def __init__(self, cache_dir: str = os.path.join('data', 'result_cache'), max_size_mb: float = 512) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, 'index.db')
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "key TEXT, name TEXT, path TEXT, size INTEGER, last_access REAL, PRIMARY KEY (key, name))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # New connection per operation, safe across threads and processes
+        return sqlite3.connect(self.index_path, timeout=30)
+
+    @staticmethod
+    def make_key(data: bytes, **params) -> str:
+        """Hash of uploaded bytes and pipeline parameters that influence the results"""
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _blob_path(self, key: str, name: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key, name)
+
+    def get(self, key: str, name: str) -> typing.Optional[bytes]:
+        path = self._blob_path(key, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE blobs SET last_access = ? WHERE key = ? AND name = ?", (time.time(), key, name)
+            ).rowcount
+        # A file without index row is a leftover of an interrupted put or eviction
+        return data if updated else None
+
+    def put(self, key: str, name: str, data: bytes) -> None:
+        path = self._blob_path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO blobs (key, name, path, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, name, path, len(data), time.time()),
+            )
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used blobs until the cache fits into max_size"""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_size:
+                return
+            for key, name, path, size in conn.execute(
+                "SELECT key, name, path, size FROM blobs ORDER BY last_access"
+            ).fetchall():
+                if total <= self.max_size:
+                    break
+                conn.execute("DELETE FROM blobs WHERE key = ? AND name = ?", (key, name))
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def get_text(self, key: str, name: str) -> typing.Optional[str]:
+        data = self.get(key, name)
+        return data.decode('utf-8') if data is not None else None
+
+    def put_text(self, key: str, name: str, text: str) -> None:
+        self.put(key, name, text.encode('utf-8'))
+
+    def get_json(self, key: str, name: str) -> typing.Optional[typing.Any]:
+        text = self.get_text(key, name)
+        return json.loads(text) if text is not None else None
+
+    def put_json(self, key: str, name: str, value: typing.Any) -> None:
+        self.put_text(key, name, json.dumps(value, ensure_ascii=False))
+
+    def get_image(self, key: str, name: str) -> typing.Optional[Image.Image]:
+        data = self.get(key, name)
+        if data is None:
+            return None
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    def put_image(self, key: str, name: str, image: Image.Image) -> None:
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        self.put(key, name, buffer.getvalue())
@@ -1,9 +1,12 @@
 import cv2
-import stow
 import typing
 import numpy as np
 import mediapipe as mp
 
+from utils.background_library import BackgroundLibrary
+from utils.mask_store import MaskStore
+from utils.temporal_cache import frame_signature, frame_change, flow_gray, warp_with_flow
+
 class MPSegmentation:
     """Object to create and do mediapipe selfie segmentation, more about it:
     https://google.github.io/mediapipe/solutions/selfie_segmentation.html
@@ -16,6 +19,14 @@ class MPSegmentation:
         model_selection: bool = 1,
         bg_images_path: str = None,
         bg_color : typing.Tuple[int, int, int] = None,
+        input_scale: float = 1.0,
+        soft_edges: bool = False,
+        reuse_output: bool = False,
+        segment_every: int = 1,
+        motion_threshold: float = 0.0,
+        mask_smoothing: float = 0.0,
+        mask_flow_warp: bool = False,
+        mask_store: typing.Optional[MaskStore] = None,
         ) -> None:
         """
         Args:
@@ -25,6 +36,15 @@ class MPSegmentation:
             model_selection: (bool) = 1 - general or landscape model selection for segmentations mask
             bg_images_path: (str) = None - path to folder for background images
             bg_color: (typing.Tuple[int, int, int]) = None - color to replace background with
+            input_scale: (float) = 1.0 - scale frame is resized by before segmentation, mask is resized back to frame size
+            soft_edges: (bool) = False - blend foreground and background by mask probability instead of hard threshold
+            reuse_output: (bool) = False - write result into one reusable buffer, returned frame is overwritten by next call
+            segment_every: (int) = 1 - run segmentation model only on every Nth frame, mask is carried forward in between
+            motion_threshold: (float) = 0.0 - if set, also run model when frame changed more than this (mean absolute change 0..1)
+                since last segmented frame
+            mask_smoothing: (float) = 0.0 - weight (0..1) of previous mask in exponential average with new model mask, reduces edge flicker
+            mask_flow_warp: (bool) = False - warp carried mask with optical flow to follow motion between model runs
+            mask_store: (MaskStore) = None - reuse masks of frames segmented before, used once source is set with set_source
         """
         self.mp_selfie_segmentation = mp.solutions.selfie_segmentation
         self.selfie_segmentation = self.mp_selfie_segmentation.SelfieSegmentation(model_selection=model_selection)
@@ -33,10 +53,32 @@ class MPSegmentation:
         self.bg_image = bg_image
         self.threshold = threshold
         self.bg_color = bg_color
+        self.input_scale = input_scale
+        self.model_selection = model_selection
+        self.soft_edges = soft_edges
+        self.reuse_output = reuse_output
+
+        # Resized background or color canvas, rebuilt only when frame size or background changes
+        self._background_key = None
+        self._background = None
+        self._background_source = None
+        self._blur_buffer = None
+        self._output = None
+
+        self.segment_every = max(1, segment_every)
+        self.motion_threshold = motion_threshold
+        self.mask_smoothing = mask_smoothing
+        self.mask_flow_warp = mask_flow_warp
+        self.stats = {"frames": 0, "segmented": 0}
+        self.reset()
+
+        self.mask_store = mask_store
+        self.source_key = None
+        self.frame_index = 0
+        self._store_key = None
 
-        if bg_images_path:
-            self.bg_images = [cv2.imread(image.path) for image in stow.ls(bg_images_path)]
-            self.bg_image = self.bg_images[0]
+        # Background folder is decoded lazily, one image at a time at the size of processed frames
+        self.bg_images = BackgroundLibrary(bg_images_path) if bg_images_path else None
 
     def change_image(self, prevOrNext: bool = True) -> bool:
         """Change image to next or previous ir they are provided
@@ -50,33 +92,193 @@ class MPSegmentation:
         if not self.bg_images:
             return False
 
-        if prevOrNext:
-            self.bg_images = self.bg_images[1:] + [self.bg_images[0]]
-        else:
-            self.bg_images = [self.bg_images[-1]] + self.bg_images[:-1]
-        self.bg_image = self.bg_images[0]
+        self.bg_images.move(1 if prevOrNext else -1)
+        size = self._background_key[0][1::-1] if self._background_key else None
+        self.bg_image = self.bg_images.current(size)
 
         return True
 
-    def __call__(self, frame: np.ndarray) -> np.ndarray:
-        """Main function to process selfie semgentation on each call
+    def segment(self, frame: np.ndarray) -> np.ndarray:
+        """Run selfie segmentation model on frame
 
         Args:
             frame: (np.ndarray) - frame to excecute selfie segmentation on
 
         Returns:
-            frame: (np.ndarray) - processed frame with selfie segmentation
+            mask: (np.ndarray) - float32 foreground probability of frame size
+        """
+        if self.input_scale < 1.0:
+            h, w = frame.shape[:2]
+            small = cv2.resize(frame, (max(1, int(w * self.input_scale)), max(1, int(h * self.input_scale))), interpolation=cv2.INTER_AREA)
+            return cv2.resize(self.selfie_segmentation.process(small).segmentation_mask, (w, h))
+
+        return self.selfie_segmentation.process(frame).segmentation_mask
+
+    def reset(self) -> None:
+        """Forget carried mask, call between unrelated videos"""
+        self._mask = None
+        self._mask_signature = None
+        self._mask_gray = None
+        self._since_segmented = 0
+
+    def set_source(self, source_key: typing.Optional[str], frame_index: int = 0) -> None:
+        """Tell which source following frames come from, so their masks can be stored and reused.
+        Every call afterwards is counted as next frame of that source
+
+        Args:
+            source_key: (str) - key of source content, e.g. MaskStore.file_key of video, None stops using mask_store
+            frame_index: (int) - index of next frame within source
+        """
+        self.reset()
+        self.source_key = source_key
+        self.frame_index = frame_index
+        self._store_key = None
+        if self.mask_store is not None and source_key is not None:
+            # Background, colour and blur are left out, they don't change the mask
+            self._store_key = MaskStore.make_key(
+                source_key, model_selection=self.model_selection, input_scale=self.input_scale,
+                segment_every=self.segment_every, motion_threshold=self.motion_threshold,
+                mask_smoothing=self.mask_smoothing, mask_flow_warp=self.mask_flow_warp,
+            )
+
+    def mask(self, frame: np.ndarray) -> np.ndarray:
+        """Foreground mask for frame, taken from mask_store when available
+
+        Args:
+            frame: (np.ndarray) - frame to get mask for
+
+        Returns:
+            mask: (np.ndarray) - float32 foreground probability of frame size
+        """
+        if self._store_key is None:
+            return self._model_mask(frame)
+
+        index = self.frame_index
+        self.frame_index += 1
+        mask = self.mask_store.get(self._store_key, index)
+        if mask is not None and mask.shape == frame.shape[:2]:
+            return mask
+
+        mask = MaskStore.quantize(self._model_mask(frame))
+        self.mask_store.put(self._store_key, index, mask)
+
+        return mask
+
+    def _model_mask(self, frame: np.ndarray) -> np.ndarray:
+        if self.segment_every > 1 or self.motion_threshold or self.mask_smoothing:
+            return self.tracked_mask(frame)
+        return self.segment(frame)
+
+    def tracked_mask(self, frame: np.ndarray) -> np.ndarray:
+        """Foreground mask for frame, running the model only every segment_every frames or on motion,
+        otherwise previous mask is carried forward (optionally warped with optical flow)
+
+        Args:
+            frame: (np.ndarray) - frame of a video or webcam stream
+
+        Returns:
+            mask: (np.ndarray) - float32 foreground probability of frame size
+        """
+        self.stats["frames"] += 1
+        signature = frame_signature(frame) if self.motion_threshold else None
+        gray = flow_gray(frame) if self.mask_flow_warp else None
+
+        carried = None
+        if self._mask is not None and self._mask.shape == frame.shape[:2]:
+            carried = warp_with_flow(self._mask, gray, self._mask_gray) if self.mask_flow_warp else self._mask
+
+        run_model = (
+            carried is None
+            or self._since_segmented + 1 >= self.segment_every
+            or (self.motion_threshold and frame_change(self._mask_signature, signature) > self.motion_threshold)
+        )
+        if not run_model:
+            self._since_segmented += 1
+            if self.mask_flow_warp:
+                # Warp is always from last segmented frame, so error doesn't accumulate between model runs
+                return carried
+            return self._mask
+
+        mask = self.segment(frame)
+        self.stats["segmented"] += 1
+        if carried is not None and self.mask_smoothing:
+            mask = cv2.addWeighted(carried, self.mask_smoothing, mask, 1.0 - self.mask_smoothing, 0)
+
+        self._mask = mask
+        self._mask_signature = signature
+        self._mask_gray = gray
+        self._since_segmented = 0
+
+        return mask
+
+    def background(self, frame: np.ndarray) -> np.ndarray:
+        """Background to place behind foreground, image and color canvas are cached per frame size
+
+        Args:
+            frame: (np.ndarray) - frame background is created for
+
+        Returns:
+            background: (np.ndarray) - uint8 background of frame shape
         """
-        results = self.selfie_segmentation.process(frame)
-        condition = np.stack((results.segmentation_mask,) * 3, axis=-1) > self.threshold
+        if self.bg_images and (self.bg_image is None or self.bg_image.shape != frame.shape):
+            # Take background from library already resized to frame size
+            self.bg_image = self.bg_images.current(frame.shape[1::-1])
+
+        if self.bg_image is None and not self.bg_color:
+            if self._blur_buffer is None or self._blur_buffer.shape != frame.shape:
+                self._blur_buffer = np.empty_like(frame)
+            return cv2.GaussianBlur(frame, self.bg_blur_ratio, 0, dst=self._blur_buffer)
+
+        # Reassigning bg_image (e.g. change_image) or bg_color invalidates cached background
+        key = (frame.shape, self.bg_color)
+        if key != self._background_key or self._background_source is not self.bg_image:
+            if self.bg_image is not None and self.bg_image.shape == frame.shape:
+                self._background = self.bg_image
+            elif self.bg_image is not None:
+                self._background = cv2.resize(self.bg_image, frame.shape[:2][::-1])
+            else:
+                self._background = np.empty(frame.shape, np.uint8)
+                self._background[:] = self.bg_color
+            self._background_key = key
+            self._background_source = self.bg_image
+
+        return self._background
+
+    def composite(self, frame: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """Place foreground of frame selected by mask over background
+
+        Args:
+            frame: (np.ndarray) - frame to take foreground from
+            mask: (np.ndarray) - single channel foreground probability of frame size
 
-        if self.bg_image is not None:
-            background = self.bg_image
-        elif self.bg_color:
-            background = np.ones(frame.shape, np.uint8)[...,:] * self.bg_color
+        Returns:
+            frame: (np.ndarray) - frame with replaced background
+        """
+        background = self.background(frame)
+
+        if self.reuse_output:
+            if self._output is None or self._output.shape != frame.shape:
+                self._output = np.empty_like(frame)
+            output = self._output
         else:
-            background = cv2.GaussianBlur(frame, self.bg_blur_ratio, 0)
+            output = np.empty_like(frame)
+
+        if self.soft_edges:
+            mask = mask.astype(np.float32, copy=False)
+            return cv2.blendLinear(frame, background, mask, 1.0 - mask, dst=output)
 
-        frame = np.where(condition, frame, cv2.resize(background, frame.shape[:2][::-1]))
- 
-        return frame.astype(np.uint8)
\ No newline at end of file
+        np.copyto(output, background)
+        cv2.copyTo(frame, cv2.compare(mask, self.threshold, cv2.CMP_GT), output)
+
+        return output
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        """Main function to process selfie semgentation on each call
+
+        Args:
+            frame: (np.ndarray) - frame to excecute selfie segmentation on
+
+        Returns:
+            frame: (np.ndarray) - processed frame with selfie segmentation
+        """
+        return self.composite(frame, self.mask(frame))
@@ -0,0 +1,249 @@
+"""Lazy frame sources and composable sinks for Engine.stream
+Sources are generators yielding BGR frames, sinks take frames one by one with write(frame),
+so frames flow from source to sinks without being collected in memory
+"""
+import io
+import os
+import abc
+import cv2
+import time
+import base64
+import typing
+import tempfile
+import threading
+import numpy as np
+from PIL import Image
+
+def video_source(video_path: str, start: int = 0, end: typing.Optional[int] = None) -> typing.Iterator[np.ndarray]:
+    """Yield frames of video file from start to end frame (inclusive)"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception(f"Error opening video stream or file {video_path}")
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    try:
+        fnum = start
+        while end is None or fnum <= end:
+            success, frame = cap.read()
+            if not success:
+                break
+            yield frame
+            fnum += 1
+    finally:
+        cap.release()
+
+def webcam_source(webcam_id: int = 0, max_failures: int = 30) -> typing.Iterator[np.ndarray]:
+    """Yield webcam frames until max_failures consecutive reads fail"""
+    cap = cv2.VideoCapture(webcam_id)
+    if not cap.isOpened():
+        raise Exception(f"Webcam with ID ({webcam_id}) can't be opened")
+    failures = 0
+    try:
+        while failures < max_failures:
+            success, frame = cap.read()
+            if not success or frame is None:
+                failures += 1
+                continue
+            failures = 0
+            yield frame
+    finally:
+        cap.release()
+
+class LatestFrameCapture:
+    """Capture thread that keeps only the newest camera frame
+    Slow processing never backs up the camera buffer, frames captured while the consumer was busy are dropped
+    """
+    def __init__(self, webcam_id: int = 0, max_failures: int = 30) -> None:
+        self.cap = cv2.VideoCapture(webcam_id)
+        if not self.cap.isOpened():
+            raise Exception(f"Webcam with ID ({webcam_id}) can't be opened")
+        self.max_failures = max_failures
+        self.dropped = 0
+        self._frame = None
+        self._timestamp = 0.0
+        self._sequence = 0
+        self._consumed = 0
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._capture, daemon=True)
+        self._thread.start()
+
+    def _capture(self) -> None:
+        failures = 0
+        while not self._stopped and failures < self.max_failures:
+            success, frame = self.cap.read()
+            if not success or frame is None:
+                failures += 1
+                continue
+            failures = 0
+            with self._condition:
+                if self._sequence > self._consumed:
+                    self.dropped += 1
+                self._frame, self._timestamp = frame, time.perf_counter()
+                self._sequence += 1
+                self._condition.notify_all()
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def read(self, poll_interval: float = 1.0) -> typing.Tuple[typing.Optional[np.ndarray], float]:
+        """Wait for a frame newer than the last one read, as long as it takes while capture is running
+        (e.g. slow camera warm-up or a stall)
+
+        Args:
+            poll_interval: (float) - seconds between checks whether capture thread is still alive
+
+        Returns:
+            (frame, timestamp) - frame and perf_counter time it was captured at, frame is None only when capture stopped
+        """
+        with self._condition:
+            while self._sequence <= self._consumed:
+                if self._stopped or not self._thread.is_alive():
+                    return None, 0.0
+                self._condition.wait(poll_interval)
+            self._consumed = self._sequence
+            return self._frame, self._timestamp
+
+    def release(self) -> None:
+        self._stopped = True
+        self._thread.join()
+        self.cap.release()
+
+
+def array_source(frames: np.ndarray) -> typing.Iterator[np.ndarray]:
+    """Yield frames of N×H×W×C array, a single H×W×C image is yielded once"""
+    if frames.ndim == 3:
+        frames = frames[None]
+    for frame in frames:
+        yield frame
+
+def image_source(images: typing.Iterable) -> typing.Iterator[np.ndarray]:
+    """Yield BGR frames decoded from image paths, encoded bytes, file-like uploads, PIL images or arrays"""
+    for image in images:
+        if isinstance(image, np.ndarray):
+            yield image
+            continue
+        if isinstance(image, Image.Image):
+            yield cv2.cvtColor(np.array(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+            continue
+        if isinstance(image, str):
+            frame = cv2.imread(image)
+        else:
+            data = image if isinstance(image, (bytes, bytearray)) else image.read()
+            frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise Exception("Unable to decode image")
+        yield frame
+
+
+class Sink(abc.ABC):
+    """Base sink, use as context manager to close it when the stream ends"""
+    @abc.abstractmethod
+    def write(self, frame: np.ndarray) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class VideoFileSink(Sink):
+    """Write frames to video file, writer is opened with the size of the first frame"""
+    def __init__(self, output_path: str, fps: float = 30, fourcc: str = 'mp4v') -> None:
+        self.output_path = output_path
+        self.fps = fps
+        self.fourcc = fourcc
+        self._writer = None
+
+    def write(self, frame: np.ndarray) -> None:
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._writer = cv2.VideoWriter(self.output_path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+        self._writer.write(frame)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+class ImageFileSink(Sink):
+    """Write every frame to its own image file, output_pattern is formatted with frame index"""
+    def __init__(self, output_pattern: str = "frame_{:06d}.png") -> None:
+        self.output_pattern = output_pattern
+        self.index = 0
+
+    def write(self, frame: np.ndarray) -> None:
+        cv2.imwrite(self.output_pattern.format(self.index), frame)
+        self.index += 1
+
+
+class MemoryVideoSink(VideoFileSink):
+    """Encode frames to video and keep the result in memory
+    OpenCV can only encode to files, so frames are written to a temporary file that is read back on close
+    """
+    def __init__(self, fps: float = 30, fourcc: str = 'mp4v', suffix: str = '.mp4') -> None:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmpfile:
+            output_path = tmpfile.name
+        super().__init__(output_path, fps, fourcc)
+        self.data = None
+
+    def close(self) -> None:
+        super().close()
+        if self.data is None and os.path.exists(self.output_path):
+            with open(self.output_path, 'rb') as f:
+                self.data = f.read()
+            os.remove(self.output_path)
+
+    def getvalue(self) -> bytes:
+        self.close()
+        return self.data
+
+    def base64(self) -> str:
+        return base64.b64encode(self.getvalue()).decode('utf-8')
+
+
+class ImageBufferSink(Sink):
+    """Encode every frame to image bytes (e.g. for display) and keep them in memory"""
+    def __init__(self, extension: str = '.png') -> None:
+        self.extension = extension
+        self.images = []
+
+    def write(self, frame: np.ndarray) -> None:
+        success, buffer = cv2.imencode(self.extension, frame)
+        if not success:
+            raise Exception(f"Unable to encode frame as {self.extension}")
+        self.images.append(io.BytesIO(buffer.tobytes()))
+
+
+class CallbackSink(Sink):
+    """Call function with every frame, e.g. to update a Streamlit placeholder"""
+    def __init__(self, callback: typing.Callable[[np.ndarray], None]) -> None:
+        self.callback = callback
+
+    def write(self, frame: np.ndarray) -> None:
+        self.callback(frame)
+
+
+def tee(frames: typing.Iterable[np.ndarray], *sinks: Sink) -> typing.Iterator[np.ndarray]:
+    """Write every frame to all sinks and yield it further, sinks are closed when frames end"""
+    try:
+        for frame in frames:
+            for sink in sinks:
+                sink.write(frame)
+            yield frame
+    finally:
+        for sink in sinks:
+            sink.close()
+
+def drain(frames: typing.Iterable[np.ndarray], *sinks: Sink) -> int:
+    """Consume frames into sinks, returns number of frames"""
+    count = 0
+    for _ in tee(frames, *sinks):
+        count += 1
+    return count
@@ -0,0 +1,142 @@
+import cv2
+import typing
+import numpy as np
+
+def frame_signature(frame: np.ndarray, size: int = 64) -> np.ndarray:
+    """Cheap downsampled grayscale version of frame used to measure frame to frame change
+
+    Args:
+        frame: (np.ndarray) - BGR frame
+        size: (int) - width and height of signature
+
+    Returns:
+        signature: (np.ndarray) - size x size float32 grayscale image
+    """
+    small = cv2.resize(frame, (size, size), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return small.astype(np.float32)
+
+def frame_change(signature: np.ndarray, other: np.ndarray) -> float:
+    """Mean absolute difference between two signatures scaled to 0..1"""
+    return float(cv2.norm(signature, other, cv2.NORM_L1)) / signature.size / 255.
+
+def flow_gray(frame: np.ndarray, width: int = 160) -> np.ndarray:
+    """Downscaled grayscale frame to compute optical flow on
+
+    Args:
+        frame: (np.ndarray) - BGR or grayscale frame
+        width: (int) - maximum width of returned frame, aspect ratio is kept
+
+    Returns:
+        gray: (np.ndarray) - uint8 grayscale frame
+    """
+    h, w = frame.shape[:2]
+    width = min(width, w)
+    small = cv2.resize(frame, (width, max(1, int(h * width / w))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+def warp_with_flow(image: np.ndarray, gray: np.ndarray, key_gray: np.ndarray) -> np.ndarray:
+    """Warp image belonging to key frame onto current frame
+
+    Args:
+        image: (np.ndarray) - image aligned with key frame, e.g. processed output or mask, any resolution
+        gray: (np.ndarray) - flow_gray of current frame
+        key_gray: (np.ndarray) - flow_gray of key frame
+
+    Returns:
+        image: (np.ndarray) - image moved to follow motion between key frame and current frame
+    """
+    # Flow from current to key frame tells for every current pixel where it was in key frame
+    flow = cv2.calcOpticalFlowFarneback(gray, key_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+    h, w = image.shape[:2]
+    scale_x, scale_y = w / gray.shape[1], h / gray.shape[0]
+    flow = cv2.resize(flow, (w, h))
+    grid_x, grid_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+    map_x = grid_x + flow[..., 0] * scale_x
+    map_y = grid_y + flow[..., 1] * scale_y
+    return cv2.remap(image, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+class TemporalReuse:
+    """Object to skip expensive custom object calls on near-static video frames
+    Every frame is compared with the last frame the wrapped object actually processed (key frame),
+    while the change stays below threshold the key frame output is reused, optionally warped with
+    optical flow to follow small motion. Comparing with the key frame instead of the previous frame
+    keeps slow drift from accumulating
+    """
+    def __init__(
+        self,
+        custom_object: typing.Callable,
+        threshold: float = 0.02,
+        max_reuse: int = 15,
+        probe_size: int = 64,
+        flow_warp: bool = False,
+        flow_width: int = 160,
+        ) -> None:
+        """
+        Args:
+            custom_object: (typing.Callable) - object to wrap, e.g. AnimeGAN
+            threshold: (float) - quality knob, mean absolute change (0..1) below which output is reused, 0 disables reuse
+            max_reuse: (int) - maximum number of consecutive frames reusing one key frame output
+            probe_size: (int) - size of downsampled frame used to measure change
+            flow_warp: (bool) - warp reused output with dense optical flow from key frame to current frame
+            flow_width: (int) - width of frames optical flow is computed on
+        """
+        self.custom_object = custom_object
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.probe_size = probe_size
+        self.flow_warp = flow_warp
+        self.flow_width = flow_width
+        self.stats = {"frames": 0, "processed": 0, "reused": 0}
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget key frame, call between unrelated videos"""
+        self._key_signature = None
+        self._key_gray = None
+        self._key_output = None
+        self._key_shape = None
+        self._reused = 0
+
+    def _flow_gray(self, frame: np.ndarray) -> np.ndarray:
+        return flow_gray(frame, self.flow_width)
+
+    def _warp(self, frame: np.ndarray) -> np.ndarray:
+        """Warp key frame output onto current frame using flow computed at reduced resolution"""
+        return warp_with_flow(self._key_output, self._flow_gray(frame), self._key_gray)
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        """Return wrapped object output for frame, reusing key frame output when frame barely changed
+
+        Args:
+            frame: (np.ndarray) - frame to process
+
+        Returns:
+            frame: (np.ndarray) - processed frame
+        """
+        self.stats["frames"] += 1
+        signature = frame_signature(frame, self.probe_size)
+
+        if (
+            self._key_output is not None
+            and self._key_shape == frame.shape
+            and self._reused < self.max_reuse
+            and frame_change(self._key_signature, signature) < self.threshold
+        ):
+            self._reused += 1
+            self.stats["reused"] += 1
+            if self.flow_warp:
+                return self._warp(frame)
+            return self._key_output.copy()
+
+        output = self.custom_object(frame)
+        self.stats["processed"] += 1
+        self._key_signature = signature
+        self._key_output = output
+        self._key_shape = frame.shape
+        self._key_gray = self._flow_gray(frame) if self.flow_warp else None
+        self._reused = 0
+
+        return output